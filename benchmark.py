@@ -0,0 +1,599 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from helpers import IngredientExtractor, RecipeProcessor, load_nlp
+from instrumentation import Histogram
+from morphology import load_analyzer
+
+CORPUS_PATH = 'content/benchmark_recipes.json'
+#Корзины длины текста в символах: от одного абзаца до текста, упирающегося в max_len токенов
+LENGTH_BUCKETS = {'short': 250, 'medium': 1000, 'long': 4000, 'xlong': 12000}
+STAGES = ['spacy', 'prepare_sequences', 'predict', 'decode']
+#Ингредиенты для синтетической базы: одни и те же продукты в разных формах
+SYNTHETIC_INGREDIENTS = [
+    'мука', 'муки', 'Мука пшеничная', 'сахар', 'сахара', 'соль', 'соли', 'яйца', 'яйцо', 'молоко', 'молока',
+    'сметана', 'сметаны', 'сметану', 'масло сливочное', 'сливочного масла', 'масло растительное', 'лук',
+    'лука', 'лук репчатый', 'морковь', 'моркови', 'картофель', 'картофеля', 'чеснок', 'чеснока', 'томатная паста',
+    'сыр', 'сыра', 'курица', 'куриное филе', 'говядина', 'свинина', 'рис', 'риса', 'гречка', 'капуста',
+    'свёкла', 'укроп', 'петрушка', 'перец чёрный молотый', 'лавровый лист', 'дрожжи', 'вода', 'кефир',
+]
+
+
+#Загружает эталонный корпус рецептов
+def load_corpus(path=CORPUS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+#Замеряет время извлечения по одному тексту и пакетами, возвращает время и результаты
+def run_extraction(extractor, texts, batch_size):
+    start = time.perf_counter()
+    single = [extractor.extract_ingredients(text) for text in texts]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batched = extractor.extract_ingredients_batch(texts, batch_size=batch_size)
+    batched_time = time.perf_counter() - start
+    return single_time, batched_time, single, batched
+
+
+#Сравнивает выравнивание до max_len с выравниванием по фактической длине текстов
+def benchmark_padding(extractor, texts, batch_size, repeat):
+    modes = ['fixed', 'exact', 'bucket']
+    reference = None
+    print(f"Документов: {len(texts)}, повторов: {repeat}, размер пакета: {batch_size}")
+    for mode in modes:
+        extractor.padding = mode
+        run_extraction(extractor, texts[:1], batch_size)
+        single_time = batched_time = 0.0
+        for _ in range(repeat):
+            s_time, b_time, single, batched = run_extraction(extractor, texts, batch_size)
+            single_time += s_time
+            batched_time += b_time
+        if reference is None:
+            reference = single
+        identical = single == reference and batched == reference
+        print(
+            f"{mode:>7}: {single_time / repeat / len(texts) * 1000:8.1f} мс/документ, "
+            f"пакетами {batched_time / repeat / len(texts) * 1000:8.1f} мс/документ, "
+            f"совпадает с fixed: {'да' if identical else 'НЕТ'}"
+        )
+    extractor.padding = 'fixed'
+
+
+#Пиковый объём памяти процесса в МБ. ru_maxrss считается в килобайтах на Linux и в байтах на macOS;
+#на Windows модуля resource нет, и вместо замера возвращается None
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 1024
+
+
+#Токенизирует корпус в отдельном процессе, чтобы замер памяти не зависел от других режимов
+def measure_tokenization(pipeline, texts, repeat):
+    start = time.perf_counter()
+    nlp = load_nlp(pipeline)
+    load_time = time.perf_counter() - start
+    tokens = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        tokens = [
+            (token.text, token.idx, token.is_stop, token.is_digit, token.like_num)
+            for doc in nlp.pipe(texts)
+            for token in doc
+        ]
+    elapsed = time.perf_counter() - start
+    return {
+        'load_time': load_time,
+        'tokens_per_second': len(tokens) * repeat / elapsed,
+        'max_rss_mb': max_rss_mb(),
+        'tokens': tokens,
+    }
+
+
+#Сравнивает полный конвейер spaCy с загрузкой одного токенизатора
+def benchmark_tokenization(texts, repeat):
+    results = {}
+    for pipeline in ['full', 'tokenizer']:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[pipeline] = executor.submit(measure_tokenization, pipeline, texts, repeat).result()
+        stats = results[pipeline]
+        memory = f"{stats['max_rss_mb']:7.1f} МБ" if stats['max_rss_mb'] is not None else "не измеряется"
+        print(
+            f"{pipeline:>9}: загрузка {stats['load_time']:6.2f} с, "
+            f"{stats['tokens_per_second']:10.0f} токенов/с, "
+            f"пик памяти {memory}"
+        )
+    identical = results['full']['tokens'] == results['tokenizer']['tokens']
+    print(f"Поток токенов совпадает: {'да' if identical else 'НЕТ'}")
+    return identical
+
+
+#Строит count текстов длиной около target символов, склеивая рецепты корпуса с разных начальных позиций.
+#Текст обрезается по границе слова, поэтому корпус одинаков между запусками
+def build_bucket(texts, target, count):
+    documents = []
+    for offset in range(count):
+        parts = []
+        length = 0
+        i = offset
+        while length < target:
+            parts.append(texts[i % len(texts)])
+            length += len(parts[-1]) + 2
+            i += 1
+        document = '\n\n'.join(parts)
+        if len(document) > target:
+            cut = document.rfind(' ', 0, target)
+            document = document[:cut if cut > 0 else target]
+        documents.append(document)
+    return documents
+
+
+#Проходит по этапам извлечения для каждого текста отдельно, как IngredientExtractor.extract_spans.
+#Возвращает задержки документов и суммарное время этапов в секундах
+def measure_stages(extractor, texts, repeat, threshold=0.4):
+    latencies = []
+    stages = dict.fromkeys(STAGES, 0.0)
+    tokens = 0
+    for _ in range(repeat):
+        for text in texts:
+            t0 = time.perf_counter()
+            doc = next(iter(extractor.nlp.pipe([text])))
+            t1 = time.perf_counter()
+            sequences = extractor.prepare_sequences([doc])
+            t2 = time.perf_counter()
+            probabilities = extractor.model.predict(sequences)[0]
+            t3 = time.perf_counter()
+            extractor._decode(text, *extractor._doc_arrays(doc, probabilities), threshold)
+            t4 = time.perf_counter()
+            for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+                stages[stage] += elapsed
+            latencies.append(t4 - t0)
+            tokens += len(doc)
+    return np.array(latencies), stages, tokens
+
+
+#Результаты одной корзины: пропускная способность по одному тексту и пакетами, перцентили задержки, доли этапов
+def benchmark_bucket(extractor, texts, repeat, batch_size):
+    extractor.extract_spans_batch(texts[:1])
+    latencies, stages, tokens = measure_stages(extractor, texts, repeat)
+    total = float(latencies.sum())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        extractor.extract_spans_batch(texts, batch_size=batch_size)
+    batch_time = time.perf_counter() - start
+    return {
+        'docs': len(texts),
+        'tokens_per_doc': tokens / len(latencies),
+        'docs_per_s': len(latencies) / total,
+        'tokens_per_s': tokens / total,
+        'latency_ms': {
+            name: float(np.percentile(latencies, q)) * 1000
+            for name, q in (('p50', 50), ('p95', 95), ('p99', 99))
+        },
+        'stages_ms': {stage: elapsed / len(latencies) * 1000 for stage, elapsed in stages.items()},
+        'stage_share': {stage: elapsed / total for stage, elapsed in stages.items()},
+        'batch_docs_per_s': len(texts) * repeat / batch_time,
+        'batch_tokens_per_s': tokens / batch_time,
+    }
+
+
+#Полный набор замеров извлечения. База рецептов не открывается: замеряется только модель.
+#Результат - словарь, пригодный для json.dump
+def run_suite(extractor, texts, count, repeat, batch_size, padding):
+    if extractor.model is None:
+        extractor.init_resources()
+    extractor.padding = padding
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'backend': extractor.backend,
+            'padding': padding,
+            'repeat': repeat,
+            'batch_size': batch_size,
+            'model_version': extractor.model_version(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+        },
+        'buckets': {},
+    }
+    for name, target in LENGTH_BUCKETS.items():
+        stats = benchmark_bucket(extractor, build_bucket(texts, target, count), repeat, batch_size)
+        results['buckets'][name] = stats
+        print(
+            f"{name:>7}: {stats['tokens_per_doc']:6.0f} токенов, {stats['docs_per_s']:8.1f} док/с, "
+            f"{stats['tokens_per_s']:9.0f} токенов/с, p50 {stats['latency_ms']['p50']:7.1f} мс, "
+            f"p99 {stats['latency_ms']['p99']:7.1f} мс, пакетами {stats['batch_docs_per_s']:8.1f} док/с | "
+            + ", ".join(f"{stage} {share:.0%}" for stage, share in stats['stage_share'].items()),
+            file=sys.stderr
+        )
+    return results
+
+
+#Метрики для сравнения запусков: ключ, значение и True, если больше - лучше
+def _metrics(bucket):
+    yield 'docs_per_s', bucket['docs_per_s'], True
+    yield 'tokens_per_s', bucket['tokens_per_s'], True
+    yield 'batch_docs_per_s', bucket['batch_docs_per_s'], True
+    for name, value in bucket['latency_ms'].items():
+        yield f'latency_{name}_ms', value, False
+    for name, value in bucket['stages_ms'].items():
+        yield f'{name}_ms', value, False
+
+
+#Сравнивает два запуска suite. Возвращает строки (корзина, метрика, было, стало, изменение, регрессия).
+#Регрессией считается ухудшение больше чем на tolerance (доля)
+def compare_runs(base, current, tolerance=0.05):
+    rows = []
+    for name, bucket in current['buckets'].items():
+        if name not in base['buckets']:
+            continue
+        before = {key: value for key, value, _ in _metrics(base['buckets'][name])}
+        for key, value, higher_is_better in _metrics(bucket):
+            old = before.get(key)
+            if not old:
+                continue
+            change = value / old - 1
+            regression = -change > tolerance if higher_is_better else change > tolerance
+            rows.append((name, key, old, value, change, regression))
+    return rows
+
+
+SYNTHETIC_STEPS = [
+    'Смешать {} и {}.', 'Добавить {}, перемешать.', 'Обжарить {} до золотистого цвета.',
+    'Натереть {} на мелкой тёрке.', 'Варить {} 20 минут, затем добавить {}.', 'Подавать с {}.',
+]
+SYNTHETIC_CATEGORIES = ['Завтраки', 'Супы', 'Выпечка', 'Салаты', 'Горячее', 'Десерты']
+
+
+#Заполняет базу count синтетическими рецептами одной транзакцией
+def populate_synthetic(processor, count, seed=0):
+    load_analyzer()
+    rng = random.Random(seed)
+    with processor.conn:
+        category_ids = []
+        for name in SYNTHETIC_CATEGORIES:
+            processor.cursor.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (name,))
+            processor.cursor.execute("SELECT id FROM categories WHERE name = ?", (name,))
+            category_ids.append(processor.cursor.fetchone()[0])
+        for i in range(count):
+            ingredients = rng.sample(SYNTHETIC_INGREDIENTS, rng.randint(3, 12))
+            text = ' '.join(
+                step.format(*rng.sample(ingredients, step.count('{}')))
+                for step in rng.sample(SYNTHETIC_STEPS, 4)
+            )
+            processor.cursor.execute(
+                "INSERT INTO recipes (name, text) VALUES (?, ?)", (f"Рецепт {i:06d} {ingredients[0]}", text)
+            )
+            recipe_id = processor.cursor.lastrowid
+            processor._write_ingredients(recipe_id, ingredients)
+            processor.cursor.execute(
+                "INSERT INTO recipe_categories (recipe_id, category_id) VALUES (?, ?)",
+                (recipe_id, rng.choice(category_ids))
+            )
+
+
+#Задержка вызова query() в миллисекундах: p50 и p99
+def measure_query(query, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query()
+        latencies.append(time.perf_counter() - start)
+    return {name: float(np.percentile(latencies, q)) * 1000 for name, q in (('p50', 50), ('p99', 99))}
+
+
+#Открывает базу с не меньше чем count рецептами, при необходимости дополняя её синтетическими
+def open_synthetic(directory, count, db_path=None):
+    processor = RecipeProcessor(db_path=db_path or os.path.join(directory, 'recipes.db'))
+    existing = processor.cursor.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+    if existing < count:
+        start = time.perf_counter()
+        populate_synthetic(processor, count - existing)
+        print(f"В базу добавлено {count - existing} рецептов за {time.perf_counter() - start:.1f} с")
+    return processor
+
+
+#Обратный поиск по ингредиентам на синтетической базе из count рецептов. Сначала проверяет,
+#что только что сохранённый рецепт находится по ингредиенту; возвращает False, если нет
+def benchmark_ingredient_lookup(count, repeat, db_path=None):
+    with tempfile.TemporaryDirectory() as directory:
+        processor = open_synthetic(directory, count, db_path)
+        try:
+            recipe_id = processor.create_recipe('Проверка поиска', 'Сметана', ['сметана', 'мука'])
+            found = (
+                recipe_id in [row[0] for row in processor.find_recipes_by_ingredient('Сметана')]
+                and recipe_id in [row[0] for row in processor.find_recipes_with_ingredients(['Сметана', 'Мука'])]
+            )
+            processor.delete_recipe(recipe_id)
+            print(f"Сохранённый рецепт найден по ингредиентам: {'да' if found else 'нет'}")
+            queries = {
+                'find_recipes_by_ingredient': lambda: processor.find_recipes_by_ingredient('сметаной'),
+                'find_recipes_with_ingredients': lambda: processor.find_recipes_with_ingredients(['мука', 'яйца', 'сахар']),
+                'find_recipes_by_ingredient_text': lambda: processor.find_recipes_by_ingredient_text('Сметана'),
+                'get_recipe_ingredients': lambda: processor.get_recipe_ingredients(count // 2),
+            }
+            for name, query in queries.items():
+                stats = measure_query(query, repeat)
+                print(f"{name:>32}: {len(query()):7d} строк, p50 {stats['p50']:8.2f} мс, p99 {stats['p99']:8.2f} мс")
+            return found
+        finally:
+            processor.close()
+
+
+#Сравнивает загрузку списка рецептов с запросом категорий для каждого рецепта и одним запросом
+def benchmark_listing(count, repeat, db_path=None):
+    with tempfile.TemporaryDirectory() as directory:
+        processor = open_synthetic(directory, count, db_path)
+        try:
+            queries = {
+                'get_recipes + get_recipe_categories': lambda: [
+                    (recipe_id, name, processor.get_recipe_categories(recipe_id))
+                    for recipe_id, name in processor.get_recipes()
+                ],
+                'get_recipes_with_categories': processor.get_recipes_with_categories,
+            }
+            for name, query in queries.items():
+                stats = measure_query(query, repeat)
+                print(f"{name:>36}: {len(query()):7d} рецептов, p50 {stats['p50']:8.2f} мс, p99 {stats['p99']:8.2f} мс")
+        finally:
+            processor.close()
+
+
+#Сравнивает поиск LIKE (search_recipes) с полнотекстовым индексом (full_text_search)
+def benchmark_search(count, repeat, db_path=None, terms=('сметан', 'Супы', 'морков', 'золотистого', 'Рецепт 0500')):
+    with tempfile.TemporaryDirectory() as directory:
+        processor = open_synthetic(directory, count, db_path)
+        try:
+            for term in terms:
+                for name, query in (
+                    ('LIKE', lambda: processor.search_recipes(term)),
+                    ('FTS5', lambda: processor.full_text_search(term)),
+                ):
+                    stats = measure_query(query, repeat)
+                    print(
+                        f"{term:>14} {name}: {len(query()):7d} строк, "
+                        f"p50 {stats['p50']:8.2f} мс, p99 {stats['p99']:8.2f} мс"
+                    )
+        finally:
+            processor.close()
+
+
+#Очистка категорий до счётчика рецептов: при удалении каждой связи перебирались все категории
+LEGACY_CATEGORY_CLEANUP = '''
+    CREATE TRIGGER delete_empty_categories
+    AFTER DELETE ON recipe_categories
+    BEGIN
+        DELETE FROM categories
+        WHERE id IN (
+            SELECT c.id FROM categories c
+            LEFT JOIN recipe_categories rc ON c.id = rc.category_id
+            WHERE rc.category_id IS NULL AND c.name NOT IN ('Все', 'Избранное')
+        );
+    END
+'''
+
+
+#Массовое удаление на синтетической библиотеке из count рецептов, разложенных ещё и по categories подборкам:
+#удаление deletes рецептов по одному, затем удаление самой большой подборки. Сравнивает прежний триггер
+#очистки категорий со счётчиком рецептов на копиях одной и той же базы
+def benchmark_deletes(count, deletes, categories):
+    with tempfile.TemporaryDirectory() as directory:
+        processor = open_synthetic(directory, count)
+        rng = random.Random(0)
+        with processor.conn:
+            recipe_ids = [row[0] for row in processor.cursor.execute("SELECT id FROM recipes")]
+            for i in range(categories):
+                processor.cursor.execute("INSERT INTO categories (name) VALUES (?)", (f"Подборка {i:04d}",))
+                category_id = processor.cursor.lastrowid
+                processor.cursor.executemany(
+                    "INSERT OR IGNORE INTO recipe_categories (recipe_id, category_id) VALUES (?, ?)",
+                    [(recipe_id, category_id) for recipe_id in rng.sample(recipe_ids, rng.randint(1, count // 10))]
+                )
+        #Копии снимаются через backup API открытого подключения: копия одного файла базы без -wal
+        #потеряла бы страницы, ещё не перенесённые из журнала
+        for mode in ('legacy', 'refcount'):
+            target = sqlite3.connect(os.path.join(directory, f'{mode}.db'))
+            try:
+                processor.conn.backup(target)
+            finally:
+                target.close()
+        processor.close()
+        victims = rng.sample(recipe_ids, deletes)
+
+        for mode in ('legacy', 'refcount'):
+            processor = RecipeProcessor(db_path=os.path.join(directory, f'{mode}.db'))
+            try:
+                if mode == 'legacy':
+                    with processor.conn:
+                        processor.cursor.execute("DROP TRIGGER category_count_insert")
+                        processor.cursor.execute("DROP TRIGGER category_count_delete")
+                        processor.cursor.execute(LEGACY_CATEGORY_CLEANUP)
+                start = time.perf_counter()
+                for recipe_id in victims:
+                    processor.delete_recipe(recipe_id)
+                recipes_time = time.perf_counter() - start
+                largest, links = processor.cursor.execute('''
+                    SELECT category_id, COUNT(*) FROM recipe_categories rc
+                    JOIN categories c ON c.id = rc.category_id
+                    WHERE c.name != 'Все' GROUP BY category_id ORDER BY COUNT(*) DESC LIMIT 1
+                ''').fetchone()
+                start = time.perf_counter()
+                processor.delete_category(largest)
+                category_time = time.perf_counter() - start
+                remaining = processor.cursor.execute("SELECT COUNT(*) FROM categories").fetchone()[0]
+                print(
+                    f"{mode:>8}: {deletes} рецептов за {recipes_time:7.2f} с ({recipes_time / deletes * 1000:7.2f} мс на рецепт), "
+                    f"категория из {links} рецептов за {category_time * 1000:9.1f} мс, осталось категорий {remaining}"
+                )
+            finally:
+                processor.close()
+
+
+#Нагрузочная проверка доступа к базе из нескольких потоков одного RecipeProcessor: писатель добавляет,
+#меняет и удаляет рецепты, читатели одновременно ищут и загружают список. Печатает число операций
+#и задержки по потокам, возвращает False при ошибках в потоках или повреждении базы
+def stress_database(readers, duration, count, db_path=None):
+    with tempfile.TemporaryDirectory() as directory:
+        processor = open_synthetic(directory, count, db_path)
+        stop = threading.Event()
+        errors = []
+        latencies = {}
+
+        def writer(rng, histogram):
+            recipe_ids = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                ingredients = rng.sample(SYNTHETIC_INGREDIENTS, 4)
+                recipe_ids.append(processor.create_recipe(f"Нагрузка {ingredients[0]}", ' '.join(ingredients), ingredients))
+                processor.update_recipe_ingredients(recipe_ids[-1], ingredients[:2])
+                if len(recipe_ids) > 50:
+                    processor.delete_recipe(recipe_ids.pop(0))
+                histogram.add(time.perf_counter() - start)
+
+        def reader(rng, histogram):
+            while not stop.is_set():
+                start = time.perf_counter()
+                processor.full_text_search(rng.choice(SYNTHETIC_INGREDIENTS), limit=20)
+                processor.get_recipes_with_categories()
+                histogram.add(time.perf_counter() - start)
+
+        def run(name, work):
+            histogram = latencies[name] = Histogram()
+            try:
+                work(random.Random(name), histogram)
+            except Exception as e:
+                errors.append(f"{name}: {e!r}")
+                stop.set()
+            finally:
+                processor.db.release()
+
+        threads = [threading.Thread(target=run, args=('writer', writer))]
+        threads += [threading.Thread(target=run, args=(f'reader-{i}', reader)) for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        stop.wait(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        try:
+            for name, histogram in latencies.items():
+                stats = histogram.to_dict()
+                print(
+                    f"{name:>10}: {stats['count']:7d} операций, {stats['count'] / duration:8.1f} в секунду, "
+                    f"p50 {stats['p50_ms']:8.2f} мс, p99 {stats['p99_ms']:8.2f} мс, макс {stats['max_ms']:8.2f} мс"
+                )
+            for error in errors:
+                print(f"Ошибка: {error}")
+            integrity = processor.conn.execute("PRAGMA integrity_check").fetchone()[0]
+            processor.conn.execute("INSERT INTO recipes_fts (recipes_fts, rank) VALUES ('integrity-check', 1)")
+            print(f"Проверка целостности: {integrity}")
+            return not errors and integrity == 'ok'
+        finally:
+            processor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки извлечения ингредиентов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    padding_parser = subparsers.add_parser('padding', help="режимы выравнивания последовательностей")
+    padding_parser.add_argument('--corpus', default=CORPUS_PATH)
+    padding_parser.add_argument('--batch-size', type=int, default=32)
+    padding_parser.add_argument('--repeat', type=int, default=3)
+    padding_parser.add_argument('--backend', default='auto', choices=['auto', 'keras', 'numpy', 'numpy-int8'])
+    tokenize_parser = subparsers.add_parser('tokenize', help="полный конвейер spaCy против токенизатора")
+    tokenize_parser.add_argument('--corpus', default=CORPUS_PATH)
+    tokenize_parser.add_argument('--repeat', type=int, default=20)
+    suite_parser = subparsers.add_parser('suite', help="пропускная способность, задержки и этапы по корзинам длины")
+    suite_parser.add_argument('--corpus', default=CORPUS_PATH)
+    suite_parser.add_argument('--docs', type=int, default=20)
+    suite_parser.add_argument('--repeat', type=int, default=3)
+    suite_parser.add_argument('--batch-size', type=int, default=32)
+    suite_parser.add_argument('--backend', default='auto', choices=['auto', 'keras', 'numpy', 'numpy-int8'])
+    suite_parser.add_argument('--padding', default='fixed', choices=['fixed', 'exact', 'bucket'])
+    suite_parser.add_argument('--output', help="файл для результатов в JSON, по умолчанию stdout")
+    lookup_parser = subparsers.add_parser('lookup', help="обратный поиск по ингредиентам на синтетической базе")
+    lookup_parser.add_argument('--recipes', type=int, default=100000)
+    lookup_parser.add_argument('--repeat', type=int, default=20)
+    lookup_parser.add_argument('--db', help="файл базы; по умолчанию временный")
+    search_parser = subparsers.add_parser('search', help="LIKE-поиск против FTS5 на синтетической базе")
+    search_parser.add_argument('--recipes', type=int, default=100000)
+    search_parser.add_argument('--repeat', type=int, default=20)
+    search_parser.add_argument('--db', help="файл базы; по умолчанию временный")
+    listing_parser = subparsers.add_parser('listing', help="загрузка списка рецептов с категориями")
+    listing_parser.add_argument('--recipes', type=int, default=5000)
+    listing_parser.add_argument('--repeat', type=int, default=10)
+    listing_parser.add_argument('--db', help="файл базы; по умолчанию временный")
+    stress_parser = subparsers.add_parser('stress', help="одновременная запись и чтение базы из нескольких потоков")
+    stress_parser.add_argument('--readers', type=int, default=4)
+    stress_parser.add_argument('--duration', type=float, default=10.0, help="секунд")
+    stress_parser.add_argument('--recipes', type=int, default=5000)
+    stress_parser.add_argument('--db', help="файл базы; по умолчанию временный")
+    deletes_parser = subparsers.add_parser('deletes', help="массовое удаление рецептов и категорий")
+    deletes_parser.add_argument('--recipes', type=int, default=10000)
+    deletes_parser.add_argument('--deletes', type=int, default=500)
+    deletes_parser.add_argument('--categories', type=int, default=100, help="дополнительных подборок рецептов")
+    compare_parser = subparsers.add_parser('compare', help="сравнить два JSON-результата suite")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.command == 'padding':
+        extractor = IngredientExtractor(args.backend)
+        extractor.init_resources()
+        benchmark_padding(extractor, load_corpus(args.corpus), args.batch_size, args.repeat)
+    elif args.command == 'tokenize':
+        if not benchmark_tokenization(load_corpus(args.corpus), args.repeat):
+            raise SystemExit(1)
+    elif args.command == 'suite':
+        extractor = IngredientExtractor(args.backend)
+        try:
+            results = run_suite(
+                extractor, load_corpus(args.corpus), args.docs, args.repeat, args.batch_size, args.padding
+            )
+        finally:
+            extractor.close()
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        else:
+            json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+    elif args.command == 'lookup':
+        if not benchmark_ingredient_lookup(args.recipes, args.repeat, args.db):
+            raise SystemExit(1)
+    elif args.command == 'search':
+        benchmark_search(args.recipes, args.repeat, args.db)
+    elif args.command == 'listing':
+        benchmark_listing(args.recipes, args.repeat, args.db)
+    elif args.command == 'stress':
+        if not stress_database(args.readers, args.duration, args.recipes, args.db):
+            raise SystemExit(1)
+    elif args.command == 'deletes':
+        benchmark_deletes(args.recipes, args.deletes, args.categories)
+    elif args.command == 'compare':
+        with open(args.base, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        rows = compare_runs(base, current, args.tolerance)
+        for name, key, old, value, change, regression in rows:
+            print(f"{name:>7} {key:>24}: {old:12.2f} -> {value:12.2f} ({change:+7.1%}){'  РЕГРЕССИЯ' if regression else ''}")
+        if any(row[-1] for row in rows):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
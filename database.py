@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+BUSY_TIMEOUT = 5.0
+#Настройки каждого подключения: NORMAL в режиме WAL не теряет согласованность при сбое,
+#но не синхронизирует диск при каждой фиксации; временные таблицы сортировок держатся в памяти
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+)
+
+
+#Подключения к файлу базы данных. Объект sqlite3 нельзя использовать из нескольких потоков одновременно,
+#поэтому каждый поток получает собственное подключение для записи (connection, cursor)
+#и собственное только для чтения (reader). База переводится в режим WAL: читатели работают
+#со снимком базы и не ждут писателя, а писатель не ждёт читателей. Одновременные записи
+#ожидают друг друга до busy_timeout секунд вместо немедленной ошибки "database is locked"
+class Database:
+    def __init__(self, path, busy_timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.readers = []
+        self.cursors = []
+        #Режим WAL сохраняется в файле базы, поэтому достаточно включить его при открытии
+        self.connection().execute("PRAGMA journal_mode = WAL")
+
+    def _open(self, readonly):
+        if readonly:
+            uri = f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self.lock:
+            (self.readers if readonly else self.connections).append(conn)
+        return conn
+
+    #Подключение текущего потока для чтения и записи
+    def connection(self):
+        conn = getattr(self.local, 'writer', None)
+        if conn is None:
+            conn = self.local.writer = self._open(readonly=False)
+        return conn
+
+    #Курсор подключения текущего потока. Один на поток, как прежний общий self.cursor
+    def cursor(self):
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is None:
+            cursor = self.local.cursor = self.connection().cursor()
+            with self.lock:
+                self.cursors.append(cursor)
+        return cursor
+
+    #Подключение текущего потока только для чтения. Не держит блокировок записи и не видит
+    #незафиксированных изменений, поэтому подходит для поиска и списков в фоновых потоках
+    def reader(self):
+        conn = getattr(self.local, 'reader', None)
+        if conn is None:
+            conn = self.local.reader = self._open(readonly=True)
+        return conn
+
+    #Закрывает подключения текущего потока, например перед завершением рабочего потока
+    def release(self):
+        for name, tracked in (('cursor', self.cursors), ('reader', self.readers), ('writer', self.connections)):
+            resource = self.local.__dict__.pop(name, None)
+            if resource is not None:
+                with self.lock:
+                    tracked.remove(resource)
+                resource.close()
+
+    #Закрывает курсоры и подключения всех потоков. Перед этим обновляет статистику планировщика
+    #для таблиц, заметно изменившихся за время работы. Файлы -wal и -shm удаляет последнее закрытое
+    #подключение, и только если у него есть право записи, поэтому курсоры и подключения для чтения
+    #закрываются раньше подключений для записи
+    def close(self):
+        writer = getattr(self.local, 'writer', None)
+        if writer is not None:
+            writer.execute("PRAGMA optimize")
+        with self.lock:
+            resources = self.cursors + self.readers + self.connections
+            self.cursors, self.readers, self.connections = [], [], []
+        for resource in resources:
+            resource.close()
+        self.local.__dict__.clear()
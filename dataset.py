@@ -0,0 +1,256 @@
+import argparse
+import ast
+import csv
+import json
+import os
+import pickle
+import sys
+import time
+from itertools import islice
+import numpy as np
+from helpers import is_candidate_token, load_nlp, pad_sequences
+from morphology import lemmatize
+
+SOURCE_PATH = 'all_recepies_inter.csv'
+OUTPUT_DIR = 'dataset'
+MANIFEST_NAME = 'manifest.json'
+SHARD_SIZE = 5000
+MAX_LEN = 400
+
+
+#Разбирает столбец composition выгрузки Kaggle: список словарей {название: количество, 'unit': единица}.
+#Возвращает список пар (название, количество) или None, если столбец не удалось разобрать
+def parse_composition(composition):
+    try:
+        items = ast.literal_eval(composition)
+    except (ValueError, SyntaxError):
+        return None
+    ingredients = []
+    for item in items:
+        if isinstance(item, dict) and item:
+            name = next(iter(item))
+            if name != 'unit':
+                quantity = ' '.join(str(value) for value in (item[name], item.get('unit')) if value)
+                ingredients.append((name, quantity))
+    return ingredients
+
+
+#Разбирает строку выгрузки Kaggle в пару (инструкция, названия ингредиентов).
+#Строки без инструкции или состава отбрасываются, как в блокноте, - для них возвращается None
+def parse_row(row):
+    instructions = row.get('Инструкции')
+    composition = row.get('composition')
+    if not instructions or not composition:
+        return None
+    ingredients = parse_composition(composition)
+    if ingredients is None:
+        return None
+    return instructions, [name for name, _ in ingredients]
+
+
+#Читает all_recepies_inter.csv построчно, не загружая файл в память целиком.
+#Для каждой строки файла возвращает результат parse_row
+def read_recipes(path=SOURCE_PATH):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            yield parse_row(row)
+
+
+#Читает манифест набора данных: список готовых шардов и число прочитанных строк источника
+def load_manifest(output_dir=OUTPUT_DIR):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'shards': [], 'rows_read': 0}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+#Возвращает примеры из шардов по одному: (индексы токенов int32, метки int8)
+def iter_examples(output_dir=OUTPUT_DIR):
+    for shard in load_manifest(output_dir)['shards']:
+        with np.load(os.path.join(output_dir, shard['file'])) as data:
+            tokens, labels, offsets = data['tokens'], data['labels'], data['offsets']
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield tokens[start:end], labels[start:end]
+
+
+#Строит обучающую выборку из рецептов: токены инструкции, их индексы в словаре и метки
+#"токен - ингредиент рецепта". Результат пишется шардами по shard_size рецептов, после каждого шарда
+#обновляется манифест, поэтому прерванную сборку можно продолжить с последнего готового шарда.
+#Разметка та же, что у get_labels в блокноте: токен размечается, если он проходит фильтр
+#и его лемма совпадает с леммой одного из слов в названиях ингредиентов
+class DatasetBuilder:
+    def __init__(self, output_dir=OUTPUT_DIR, shard_size=SHARD_SIZE, n_process=1, batch_size=256):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.n_process = n_process
+        self.batch_size = batch_size
+        self.nlp = None
+        self.vocab = {"<UNK>": 1, "<PAD>": 0}
+        self.manifest = {'shards': [], 'rows_read': 0}
+        #Леммы слов названия ингредиента: названия часто повторяются между рецептами
+        self.name_lemmas = {}
+
+    #Восстанавливает словарь по уже записанным шардам. Каждый шард хранит токены,
+    #впервые встреченные в нём, в порядке присвоения индексов
+    def resume(self):
+        self.manifest = load_manifest(self.output_dir)
+        for shard in self.manifest['shards']:
+            if shard['vocab_start'] != len(self.vocab):
+                raise ValueError(f"Shard {shard['file']} does not continue the vocabulary")
+            with np.load(os.path.join(self.output_dir, shard['file'])) as data:
+                new_tokens = json.loads(data['new_tokens'].tobytes().decode('utf-8'))
+            for token in new_tokens:
+                self.vocab[token] = len(self.vocab)
+        return self.manifest['rows_read']
+
+    #Обрабатывает записи read_recipes, пропуская строки, учтённые в манифесте.
+    #progress(шарды, строки, примеры) вызывается после записи каждого шарда
+    def build(self, records, progress=None):
+        if self.nlp is None:
+            self.nlp = load_nlp('tokenizer')
+        os.makedirs(self.output_dir, exist_ok=True)
+        rows_read = self.manifest['rows_read']
+        pending = []
+        for record in islice(records, rows_read, None):
+            rows_read += 1
+            if record is not None:
+                pending.append(record)
+            if len(pending) == self.shard_size:
+                self._write_shard(pending, rows_read)
+                pending = []
+                if progress:
+                    progress(len(self.manifest['shards']), rows_read, self.example_count())
+        if pending:
+            self._write_shard(pending, rows_read)
+        elif rows_read != self.manifest['rows_read']:
+            self.manifest['rows_read'] = rows_read
+            self._save_manifest()
+        with open(os.path.join(self.output_dir, 'vocab.pkl'), 'wb') as f:
+            pickle.dump({'vocab': self.vocab}, f)
+        return self.manifest
+
+    def example_count(self):
+        return sum(shard['examples'] for shard in self.manifest['shards'])
+
+    #Множество лемм для каждого нового названия ингредиента. Названия токенизируются одним пакетом
+    def _learn_names(self, names):
+        unknown = list({name for name in names if name not in self.name_lemmas})
+        for name, doc in zip(unknown, self.nlp.pipe(unknown, batch_size=self.batch_size)):
+            self.name_lemmas[name] = frozenset(lemmatize(token.text) for token in doc if is_candidate_token(token))
+
+    def _write_shard(self, records, rows_read):
+        self._learn_names(name for _, names in records for name in names)
+        vocab = self.vocab
+        vocab_start = len(vocab)
+        new_tokens = []
+        tokens = []
+        labels = []
+        offsets = [0]
+        texts = (instructions for instructions, _ in records)
+        docs = self.nlp.pipe(texts, n_process=self.n_process, batch_size=self.batch_size)
+        for doc, (_, names) in zip(docs, records):
+            lemmas = frozenset().union(*(self.name_lemmas[name] for name in names))
+            for token in doc:
+                text = token.text
+                if text not in vocab:
+                    vocab[text] = len(vocab)
+                    new_tokens.append(text)
+                tokens.append(vocab[text])
+                labels.append(bool(lemmas) and is_candidate_token(token) and lemmatize(text) in lemmas)
+            offsets.append(len(tokens))
+
+        name = f"shard-{len(self.manifest['shards']):05d}.npz"
+        temporary = os.path.join(self.output_dir, name + '.tmp.npz')
+        np.savez(
+            temporary,
+            tokens=np.array(tokens, dtype=np.int32),
+            labels=np.array(labels, dtype=np.int8),
+            offsets=np.array(offsets, dtype=np.int64),
+            new_tokens=np.frombuffer(json.dumps(new_tokens, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+        )
+        os.replace(temporary, os.path.join(self.output_dir, name))
+        self.manifest['shards'].append({
+            'file': name,
+            'examples': len(records),
+            'tokens': len(tokens),
+            'vocab_start': vocab_start,
+        })
+        self.manifest['rows_read'] = rows_read
+        self._save_manifest()
+
+    #Манифест заменяется атомарно: после сбоя он описывает только полностью записанные шарды
+    def _save_manifest(self):
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+#Собирает из шардов файл в формате data123.pkl блокнота: выравнивание до max_len
+#и случайное разбиение на обучающую и проверочную части
+def export_arrays(output_dir=OUTPUT_DIR, path='data123.pkl', max_len=MAX_LEN, val_fraction=0.2, seed=42):
+    sequences = []
+    labels = []
+    for tokens, token_labels in iter_examples(output_dir):
+        sequences.append(tokens)
+        labels.append(token_labels)
+    X_seq = pad_sequences(sequences, max_len)
+    y_seq = pad_sequences(labels, max_len).astype(np.float32)[..., None]
+    order = np.random.default_rng(seed).permutation(len(X_seq))
+    val_size = int(len(order) * val_fraction)
+    val, train = order[:val_size], order[val_size:]
+    with open(os.path.join(output_dir, 'vocab.pkl'), 'rb') as f:
+        vocab = pickle.load(f)['vocab']
+    with open(path, 'wb') as f:
+        pickle.dump({
+            'X_seq': X_seq,
+            'y_seq': y_seq,
+            'X_train': X_seq[train],
+            'X_val': X_seq[val],
+            'y_train': y_seq[train],
+            'y_val': y_seq[val],
+            'vocab': vocab,
+        }, f)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка обучающей выборки для модели выделения ингредиентов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="разметить рецепты и записать шарды")
+    build_parser.add_argument('--source', default=SOURCE_PATH)
+    build_parser.add_argument('--output', default=OUTPUT_DIR)
+    build_parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    build_parser.add_argument('--n-process', type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    build_parser.add_argument('--batch-size', type=int, default=256)
+    export_parser = subparsers.add_parser('export', help="собрать data123.pkl из шардов")
+    export_parser.add_argument('--output', default=OUTPUT_DIR)
+    export_parser.add_argument('--path', default='data123.pkl')
+    export_parser.add_argument('--max-len', type=int, default=MAX_LEN)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        builder = DatasetBuilder(args.output, args.shard_size, args.n_process, args.batch_size)
+        skipped = builder.resume()
+        if skipped:
+            print(f"Продолжение сборки: {len(builder.manifest['shards'])} шардов, {skipped} строк уже обработано")
+        start = time.perf_counter()
+
+        def report(shards, rows, examples):
+            cache = lemmatize.cache_info()
+            print(
+                f"Шард {shards}: строк {rows}, примеров {examples}, словарь {len(builder.vocab)}, "
+                f"{(rows - skipped) / (time.perf_counter() - start):.0f} строк/с, "
+                f"попаданий в кэш лемм {cache.hits / max(cache.hits + cache.misses, 1):.0%}"
+            )
+
+        manifest = builder.build(read_recipes(args.source), progress=report)
+        print(f"Готово: {builder.example_count()} примеров в {len(manifest['shards'])} шардах, словарь {len(builder.vocab)}")
+    elif args.command == 'export':
+        print(f"Записано в {export_arrays(args.output, args.path, args.max_len)}")
+
+
+if __name__ == "__main__":
+    main()
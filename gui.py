@@ -1,15 +1,22 @@
 import sys
 import os
+import re
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QListWidget, QTextEdit, QLineEdit, QPushButton, QLabel,
     QMessageBox, QInputDialog, QListWidgetItem, QFileDialog, QSizePolicy,
     QCheckBox, QFrame, QMenu, QScrollArea, QTableWidget, QTableWidgetItem, QHeaderView, QDialog, QDialogButtonBox,
-    QAbstractItemView
+    QAbstractItemView, QProgressBar
 )
-from PySide6.QtCore import Qt, Signal, QSize, QPoint
-from PySide6.QtGui import QPixmap, QImage, QPainter, QColor, QFont
+from PySide6.QtCore import Qt, Signal, QSize, QPoint, QObject, QTimer
+from PySide6.QtGui import QPixmap, QImage, QPainter, QColor, QFont, QTextCharFormat, QTextCursor
 from helpers import RecipeProcessor
+from instrumentation import timed
+from workers import ExtractionService, SearchService
+
+class ResourceSignals(QObject):
+    ready = Signal()
+    failed = Signal(str)
 
 class RecipeApp(QMainWindow):
     #Инициализирует главное окно, класс RecipeProcessor, стили приложения, создаёт папки для изображений
@@ -23,7 +30,37 @@ class RecipeApp(QMainWindow):
         self.load_recipes()
         self.current_ingredients = []
         self.selected_recipe_id = None
+        self.extraction_job = None
         self.load_stylesheet("content/default_theme.qss")
+        self.load_resources()
+        self.extraction_service = ExtractionService(self.processor, self)
+        self.extraction_service.progress.connect(self.on_extraction_progress)
+        self.extraction_service.finished.connect(self.on_extraction_finished)
+        self.extraction_service.failed.connect(self.on_extraction_failed)
+        self.highlighter = IngredientHighlighter(self.recipe_text, self.extraction_service, self)
+        self.search_service = SearchService(self.processor, self)
+        self.search_controller = SearchController(self.search_bar, self.recipe_list, self.search_service, self)
+    #Запускает фоновую загрузку нейронной сети, окно доступно сразу
+    def load_resources(self):
+        self.resource_signals = ResourceSignals()
+        self.resource_signals.ready.connect(self.on_resources_ready)
+        self.resource_signals.failed.connect(self.on_resources_failed)
+        self.statusBar().showMessage("Загрузка модели...")
+        self.processor.load_resources_async(
+            on_ready=self.resource_signals.ready.emit,
+            on_failed=self.resource_signals.failed.emit
+        )
+    #Вызывается после загрузки модели
+    def on_resources_ready(self):
+        self.statusBar().showMessage("Модель загружена", 3000)
+    #Сообщает об ошибке загрузки модели
+    def on_resources_failed(self, message):
+        self.statusBar().showMessage("Не удалось загрузить модель", 3000)
+    #Останавливает фоновые задания при закрытии окна
+    def closeEvent(self, event):
+        self.extraction_service.shutdown()
+        self.search_service.shutdown()
+        super().closeEvent(event)
     #Применяет стили
     def load_stylesheet(self, filename):
         try:
@@ -158,11 +195,16 @@ class RecipeApp(QMainWindow):
         self.recipe_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.recipe_list.customContextMenuRequested.connect(self.show_recipe_context_menu)
 
+        self.extraction_progress = QProgressBar()
+        self.extraction_progress.setMaximumWidth(200)
+        self.extraction_progress.setRange(0, 100)
+        self.extraction_progress.hide()
+        self.statusBar().addPermanentWidget(self.extraction_progress)
+
         self.statusBar().showMessage("Готово")
     #Соединяет сигналы виджетов с их обработчиками
     def connect_signals(self):
         self.recipe_list.itemClicked.connect(self.load_recipe)
-        self.search_bar.textChanged.connect(self.search_recipes)
         self.extract_button.clicked.connect(self.extract_ingredients)
         self.save_button.clicked.connect(self.save_recipe)
         self.order_button.clicked.connect(self.order_ingredients)
@@ -171,6 +213,7 @@ class RecipeApp(QMainWindow):
         self.add_ingredient_btn.clicked.connect(self.add_ingredient)
         self.edit_ingredient_btn.clicked.connect(self.edit_ingredient)
         self.remove_ingredient_btn.clicked.connect(self.remove_ingredients)
+        self.recipe_text.textChanged.connect(self.cancel_extraction)
     #Отображает контекстное меню
     def show_recipe_context_menu(self, position):
         item = self.recipe_list.itemAt(position)
@@ -233,10 +276,11 @@ class RecipeApp(QMainWindow):
             self.statusBar().showMessage(f"Создана новая категория: {category_name}", 3000)
             self.load_recipes()
     #Загружает рецепты из базы данных, создаёт для каждого рецепта виджет, обрабатывает изображения
+    @timed('gui.load_recipes')
     def load_recipes(self):
         self.recipe_list.clear()
-        recipes = self.processor.get_recipes()
-        for recipe_id, name in recipes:
+        recipes = self.processor.get_recipes_with_categories()
+        for recipe_id, name, categories in recipes:
             item = QListWidgetItem()
             item.setData(Qt.UserRole, recipe_id)
             img_path = self.get_recipe_image_path(recipe_id)
@@ -244,14 +288,16 @@ class RecipeApp(QMainWindow):
                 img_path = "content/placeholder_image.png"
             widget = RecipeListItemWidget(name, recipe_id, img_path)
             widget.image_clicked.connect(self.change_recipe_image)
-            categories = self.processor.get_recipe_categories(recipe_id)
             for category_id, category_name in categories:
                 if category_name != "Все":
-                    widget.add_category_tag(category_name, category_id, lambda cid=category_id: self.remove_recipe_from_category(recipe_id, cid))
+                    widget.add_category_tag(category_name, category_id, lambda cid=category_id, rid=recipe_id: self.remove_recipe_from_category(rid, cid))
             item.setSizeHint(QSize(200, 100))
             self.recipe_list.addItem(item)
             self.recipe_list.setItemWidget(item, widget)
             self.recipe_list.resizeEvent(None)
+        #Список перестроен заново - фильтр поиска нужно применить к новым элементам
+        if hasattr(self, 'search_controller'):
+            self.search_controller.search()
     #Возвращает путь до изображения рецепта
     def get_recipe_image_path(self, recipe_id):
         return os.path.join(self.recipe_images_dir, f"{recipe_id}.png")
@@ -281,6 +327,7 @@ class RecipeApp(QMainWindow):
                 self.load_recipe(item)
                 break
     #Загружает данные рецепта из базы данных
+    @timed('gui.load_recipe')
     def load_recipe(self, item):
         try:
             recipe_id = item.data(Qt.UserRole)
@@ -324,13 +371,44 @@ class RecipeApp(QMainWindow):
             )
             if reply == QMessageBox.No:
                 return
+        if self.processor.resources_error:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось извлечь ингредиенты: {self.processor.resources_error}")
+            return
+        self.cancel_extraction()
+        job_id = self.extraction_service.submit(text)
+        self.extraction_job = (job_id, self.selected_recipe_id, text)
+        self.extraction_progress.setValue(0)
+        self.extraction_progress.show()
+        if self.processor.is_ready():
+            self.statusBar().showMessage("Поиск ингредиентов...")
+        else:
+            self.statusBar().showMessage("Модель загружается, ингредиенты будут найдены после загрузки")
+    #Отменяет текущее извлечение, если пользователь изменил текст или выбрал другой рецепт
+    def cancel_extraction(self):
+        if self.extraction_job is None:
+            return
+        self.extraction_service.cancel(self.extraction_job[0])
+        self.extraction_job = None
+        self.extraction_progress.hide()
+        self.statusBar().showMessage("Поиск ингредиентов отменён", 3000)
+    #Отображает ход извлечения ингредиентов
+    def on_extraction_progress(self, job_id, percent):
+        if self.extraction_job and self.extraction_job[0] == job_id:
+            self.extraction_progress.setValue(percent)
+    #Применяет результат извлечения, сохраняет ингредиенты в базе данных. Устаревшие результаты отбрасываются
+    def on_extraction_finished(self, job_id, extracted):
+        if not self.extraction_job or self.extraction_job[0] != job_id:
+            return
+        _, recipe_id, text = self.extraction_job
+        self.extraction_job = None
+        self.extraction_progress.hide()
         try:
-            extracted = self.processor.extract_ingredients(text)
+            extracted = self.processor.canonical_names(extracted)
             self.current_ingredients = extracted
             self.update_ingredients_list()
-            if self.selected_recipe_id and extracted:
+            if recipe_id and extracted:
                 self.processor.update_recipe(
-                    self.selected_recipe_id,
+                    recipe_id,
                     self.recipe_name.text().strip(),
                     text,
                     extracted
@@ -346,6 +424,13 @@ class RecipeApp(QMainWindow):
                 )
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось извлечь ингредиенты: {str(e)}")
+    #Сообщает об ошибке извлечения
+    def on_extraction_failed(self, job_id, message):
+        if not self.extraction_job or self.extraction_job[0] != job_id:
+            return
+        self.extraction_job = None
+        self.extraction_progress.hide()
+        QMessageBox.critical(self, "Ошибка", f"Не удалось извлечь ингредиенты: {message}")
     #Осуществляет сохранение рецептов
     def save_recipe(self):
         name = self.recipe_name.text().strip()
@@ -621,39 +706,21 @@ class RecipeApp(QMainWindow):
         if not self.current_ingredients:
             QMessageBox.information(self, "Заказать Ингредиенты", "Нет ингредиентов для заказа.")
             return
+        #Один и тот же продукт в разных формах ("мука", "муки") ищется в магазине один раз
+        products = self.processor.canonical_names(self.current_ingredients)
         if hasattr(self, 'order_window') and self.order_window:
-            self.order_window.yandex_food.update_ingredients(self.current_ingredients)
+            self.order_window.yandex_food.update_ingredients(products)
             self.order_window.show()
             self.order_window.raise_()
             self.order_window.activateWindow()
         else:
             from ordering import MainWindow
-            self.order_window = MainWindow(self.current_ingredients)
+            self.order_window = MainWindow(products)
             self.order_window.show()
         self.statusBar().showMessage(
-            f"Готов к заказу {len(self.current_ingredients)} ингредиентов",
+            f"Готов к заказу {len(products)} ингредиентов",
             3000
         )
-    #Выполняет поиск рецептов по категориям и по названиям, динамически обновляет список
-    def search_recipes(self, text):
-        results = self.processor.search_recipes(text)
-        self.recipe_list.clear()
-        for recipe_id, name in results:
-            item = QListWidgetItem()
-            item.setData(Qt.UserRole, recipe_id)
-            img_path = self.get_recipe_image_path(recipe_id)
-            if not os.path.exists(img_path):
-                img_path = "content/placeholder_image.png"
-            widget = RecipeListItemWidget(name, recipe_id, img_path)
-            widget.image_clicked.connect(self.change_recipe_image)
-            categories = self.processor.get_recipe_categories(recipe_id)
-            for category_id, category_name in categories:
-                if category_name not in ["Все"]:
-                    widget.add_category_tag(category_name, category_id, lambda cid=category_id: self.remove_recipe_from_category(recipe_id, cid))
-            item.setSizeHint(QSize(200, 100))
-            self.recipe_list.addItem(item)
-            self.recipe_list.setItemWidget(item, widget)
-            self.recipe_list.resizeEvent(None)
 
 
 class RecipeListWidget(QListWidget):
@@ -687,6 +754,124 @@ class QEnhancedTextEdit(QTextEdit):
 
 
 
+#Длина строки в единицах UTF-16, которыми считает позиции QTextDocument
+def utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+class IngredientHighlighter(QObject):
+    #Подсвечивает ингредиенты в тексте по мере ввода. Текст делится на абзацы, результаты хранятся
+    #по тексту абзаца, поэтому после правки заново обрабатываются только изменённые абзацы
+    def __init__(self, text_edit, service, parent=None, delay=500, cache_size=2000):
+        super().__init__(parent)
+        self.text_edit = text_edit
+        self.service = service
+        self.cache_size = cache_size
+        self.segment_spans = {}
+        self.job_id = None
+        self.format = QTextCharFormat()
+        self.format.setBackground(QColor(255, 214, 102, 140))
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.refresh)
+        self.text_edit.textChanged.connect(self.timer.start)
+        self.service.spans_finished.connect(self.on_spans_finished)
+    #Возвращает абзацы текста вместе с их позициями в документе. QTextCursor считает позиции
+    #в единицах UTF-16, поэтому символы вне BMP (например, эмодзи) занимают две позиции
+    def segments(self):
+        text = self.text_edit.toPlainText()
+        segments = []
+        position = 0
+        document_position = 0
+        for m in re.finditer(r'[^\n]+', text):
+            if m.group().strip():
+                document_position += utf16_length(text[position:m.start()])
+                position = m.start()
+                segments.append((document_position, m.group()))
+        return segments
+    #Отправляет на обработку абзацы, которых ещё нет в кэше, и подсвечивает уже известные
+    def refresh(self):
+        segments = self.segments()
+        missing = list(dict.fromkeys(text for _, text in segments if text not in self.segment_spans))
+        if self.job_id is not None:
+            self.service.cancel(self.job_id)
+            self.job_id = None
+        if missing:
+            self.job_id = self.service.submit_spans(missing)
+        self.apply(segments)
+    #Сохраняет границы ингредиентов обработанных абзацев
+    def on_spans_finished(self, job_id, texts, spans):
+        if len(self.segment_spans) + len(texts) > self.cache_size:
+            current = {text for _, text in self.segments()}
+            self.segment_spans = {text: value for text, value in self.segment_spans.items() if text in current}
+        self.segment_spans.update(zip(texts, spans))
+        if job_id == self.job_id:
+            self.job_id = None
+            self.apply(self.segments())
+    #Применяет подсветку через дополнительные выделения, не изменяя документ и историю правок
+    def apply(self, segments):
+        document = self.text_edit.document()
+        selections = []
+        for offset, text in segments:
+            for span in self.segment_spans.get(text, ()):
+                selection = QTextEdit.ExtraSelection()
+                selection.cursor = QTextCursor(document)
+                selection.cursor.setPosition(offset + utf16_length(text[:span['start']]))
+                selection.cursor.setPosition(offset + utf16_length(text[:span['end']]), QTextCursor.KeepAnchor)
+                selection.format = self.format
+                selections.append(selection)
+        self.text_edit.setExtraSelections(selections)
+
+
+
+class SearchController(QObject):
+    #Поиск по мере ввода: запрос уходит в SearchService после паузы в наборе, ответы на устаревшие
+    #запросы отбрасываются. Список рецептов не перестраивается - меняется только видимость элементов
+    def __init__(self, search_bar, recipe_list, service, parent=None, delay=250):
+        super().__init__(parent)
+        self.search_bar = search_bar
+        self.recipe_list = recipe_list
+        self.service = service
+        self.job_id = None
+        self.matches = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.search)
+        self.search_bar.textChanged.connect(self.timer.start)
+        self.service.finished.connect(self.on_finished)
+        self.service.failed.connect(self.on_failed)
+    #Отправляет запрос сразу. Пустой запрос показывает все рецепты без обращения к базе
+    def search(self, text=None):
+        self.timer.stop()
+        text = self.search_bar.text() if text is None else text
+        if not text.strip():
+            self.job_id = None
+            self.matches = None
+            self.apply()
+            return
+        self.job_id = self.service.submit(text)
+    #Применяет результат последнего запроса
+    def on_finished(self, job_id, text, ids):
+        if job_id != self.job_id:
+            return
+        self.job_id = None
+        self.matches = set(ids)
+        self.apply()
+    def on_failed(self, job_id, message):
+        if job_id == self.job_id:
+            self.job_id = None
+            print(f"Error searching recipes: {message}")
+    #Скрывает рецепты, не попавшие в результат, меняя только элементы, чьё состояние изменилось
+    def apply(self):
+        for i in range(self.recipe_list.count()):
+            item = self.recipe_list.item(i)
+            hidden = self.matches is not None and item.data(Qt.UserRole) not in self.matches
+            if item.isHidden() != hidden:
+                item.setHidden(hidden)
+
+
 class RecipeListItemWidget(QWidget):
     #Инициализация основных переменных
     image_clicked = Signal(int)
@@ -769,6 +954,7 @@ class RecipeListItemWidget(QWidget):
                 scaled_pixmap = scaled_pixmap.copy(x, y, image_width, height)
             self.image_label.setPixmap(scaled_pixmap)
     #Загружает изображение рецепта, если оно не задано загружается стандартное изображение
+    @timed('gui.load_image')
     def load_image(self):
         if not os.path.exists(self.image_path):
             self.image_path = "content/placeholder_image.png"
@@ -1,93 +1,598 @@
-import sqlite3
-import pickle
-import spacy
-# noinspection PyUnresolvedReferences
-from tensorflow.keras.models import load_model
-# noinspection PyUnresolvedReferences
-from tensorflow.keras.preprocessing.sequence import pad_sequences
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from itertools import groupby, islice
+import numpy as np
+from database import Database
+from instrumentation import metrics, timed
+from migrations import migrate
 
-class RecipeProcessor:
-    def __init__(self):
+
+DB_PATH = 'recipes.db'
+#Выравнивание пакетов для извлечения в приложении, см. IngredientExtractor._padded_length
+APP_PADDING = 'bucket'
+VOCAB_PATH = 'minimal_data.pkl'
+VOCAB_TABLE_PATH = 'vocab.bin'
+
+#Ключей в одном запросе к кэшу извлечения: ниже ограничения SQLite на число параметров
+CACHE_QUERY_CHUNK = 500
+
+_file_digests = {}
+
+
+#Возвращает sha256 содержимого файла, пересчитывая его только при изменении размера или времени изменения
+def file_digest(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 'missing'
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+
+#Выравнивает последовательности индексов до длины maxlen, дополняя и обрезая их с конца
+def pad_sequences(sequences, maxlen, value=0):
+    padded = np.full((len(sequences), maxlen), value, dtype=np.int32)
+    for i, sequence in enumerate(sequences):
+        sequence = sequence[:maxlen]
+        padded[i, :len(sequence)] = sequence
+    return padded
+
+
+#Отсортированный список уникальных названий ингредиентов из результатов extract_spans
+def ingredient_names(spans):
+    return sorted({span['text'] for span in spans})
+
+
+#Строит выражение MATCH для FTS5 из пользовательского запроса: все слова обязательны,
+#каждое ищется как префикс. У длинных слов отбрасывается окончание, чтобы находились другие падежи.
+#Токенизатор не считает "ё" и "е" одной буквой, поэтому слово ищется и в написании с "ё"
+def fts_query(text):
+    terms = []
+    for word in re.findall(r'\w+', text.lower()):
+        keep = len(word) - 2 if len(word) >= 6 else len(word) - 1 if len(word) >= 4 else len(word)
+        stem = word[:keep].replace('ё', 'е')
+        variants = [stem] + [stem[:i] + 'ё' + stem[i + 1:] for i, char in enumerate(stem) if char == 'е']
+        terms.append('(' + ' OR '.join(f'"{variant}"*' for variant in variants) + ')')
+    return ' AND '.join(terms)
+
+
+#Токен может быть ингредиентом: не короче двух символов, не стоп-слово, начинается с буквы и не число.
+#По этим же правилам размечаются обучающие данные (dataset.py)
+def is_candidate_token(token):
+    if len(token.text) < 2:
+        return False
+    if token.is_stop:
+        return False
+    if not token.text[0].isalpha():
+        return False
+    if token.is_digit or token.like_num:
+        return False
+    return True
+
+
+#Компоненты ru_core_news_sm, которые не нужны для выделения ингредиентов: токены, их позиции
+#и лексические признаки (is_stop, is_digit, like_num) создаёт токенизатор, а компоненты не меняют разбиение на токены
+PIPELINE_COMPONENTS = ["tok2vec", "morphologizer", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"]
+
+
+#Загружает spaCy: pipeline='tokenizer' - только токенизатор, 'full' - полный конвейер
+def load_nlp(pipeline='tokenizer'):
+    import spacy
+    if pipeline == 'tokenizer':
+        return spacy.load("ru_core_news_sm", exclude=PIPELINE_COMPONENTS)
+    if pipeline == 'full':
+        return spacy.load("ru_core_news_sm")
+    raise ValueError(f"Unknown spaCy pipeline mode: {pipeline}")
+
+
+#Нейросетевая часть: токенизатор spaCy, словарь и модель выделения ингредиентов.
+#Тяжёлые библиотеки импортируются только в init_resources.
+#backend выбирает бэкенд инференса из inference.py: 'keras', 'numpy', 'numpy-int8' или 'auto',
+#pipeline - режим загрузки spaCy (см. load_nlp)
+class IngredientExtractor:
+    def __init__(self, backend='auto', pipeline='tokenizer'):
+        self.backend = backend
+        self.pipeline = pipeline
         self.model = None
         self.nlp = None
         self.vocab = None
         self.max_len = 2000
-        self.init_resources()
-        self.init_db()
+        #Режим выравнивания последовательностей: 'fixed' - всегда до max_len,
+        #'exact' - до длины самого длинного текста в пакете, 'bucket' - до ближайшей степени двойки
+        self.padding = 'fixed'
 
     #Инициализация ресурсов для нейронной сети
     def init_resources(self):
         try:
-            self.nlp = spacy.load("ru_core_news_sm")
-            with open('minimal_data.pkl', 'rb') as f:
-                data = pickle.load(f)
-                self.vocab = data['vocab']
-            self.model = load_model('recognize_model.keras')
+            from inference import load_backend
+            with metrics.timer('model.load_nlp'):
+                self.nlp = load_nlp(self.pipeline)
+            from vocab import load_vocabulary
+            with metrics.timer('model.load_vocab'):
+                self.vocab = load_vocabulary(VOCAB_TABLE_PATH, VOCAB_PATH)
+            with metrics.timer('model.load_backend'):
+                self.model = load_backend(self.backend)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize resources: {str(e)}")
 
     #Метод фильтрации токенов
     def _filter(self, token):
-        if len(token.text) < 2:
-            return False
-        if token.is_stop:
-            return False
-        if not token.text[0].isalpha():
-            return False
-        if token.is_digit or token.like_num:
-            return False
-        return True
+        return is_candidate_token(token)
+
+    #Возвращает длину, до которой выравнивается пакет с самым длинным текстом длины length.
+    #Маскирование <PAD> в слое Embedding делает результат независимым от длины выравнивания.
+    #padding заменяет self.padding для одного вызова
+    def _padded_length(self, length, padding=None):
+        padding = padding or self.padding
+        length = min(max(length, 1), self.max_len)
+        if padding == 'exact':
+            return length
+        if padding == 'bucket':
+            return min(self.max_len, max(16, 1 << (length - 1).bit_length()))
+        return self.max_len
 
     #Подготавливает данные для передачи в нейронную сеть
-    def prepare_sequences(self, texts):
-        if not self.vocab:
+    @timed('extract.prepare_sequences')
+    def prepare_sequences(self, texts, padding=None):
+        if self.vocab is None:
             raise ValueError("Vocabulary not loaded")
-        X = [[self.vocab.get(w.text, self.vocab["<UNK>"]) for w in s] for s in texts]
+        X = [self.vocab.lookup([w.text for w in s]) for s in texts]
         return pad_sequences(
-            maxlen=self.max_len,
-            sequences=X,
-            padding="post",
-            value=self.vocab["<PAD>"]
+            X,
+            maxlen=self._padded_length(max((len(x) for x in X), default=0), padding),
+            value=self.vocab.pad_id
         )
 
+    #Возвращает массивы начал и концов токенов, маску фильтра и вероятности для документа
+    @timed('extract.doc_arrays')
+    def _doc_arrays(self, doc, probabilities):
+        n = min(len(doc), len(probabilities))
+        tokens = [doc[i] for i in range(n)]
+        starts = np.fromiter((token.idx for token in tokens), dtype=np.int64, count=n)
+        ends = starts + np.fromiter((len(token.text) for token in tokens), dtype=np.int64, count=n)
+        mask = np.fromiter((self._filter(token) for token in tokens), dtype=bool, count=n)
+        return starts, ends, mask, np.asarray(probabilities[:n], dtype=np.float32).reshape(n)
+
+    #Находит ингредиенты как непрерывные последовательности токенов, прошедших фильтр и порог.
+    #Возвращает список словарей: текст, позиции в тексте, средняя и максимальная вероятность
+    @timed('extract.decode')
+    def _decode(self, text, starts, ends, mask, probabilities, threshold):
+        active = (probabilities > threshold) & mask
+        if not active.any():
+            return []
+        edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)
+        sums = np.concatenate(([0.0], np.cumsum(probabilities, dtype=np.float64)))
+        means = (sums[run_ends] - sums[run_starts]) / (run_ends - run_starts)
+        maxima = np.maximum.reduceat(
+            np.append(probabilities, 0.0), np.column_stack([run_starts, run_ends]).ravel()
+        )[::2]
+        return [
+            {
+                'text': text[start:end].strip(),
+                'start': int(start),
+                'end': int(end),
+                'mean_prob': float(mean),
+                'max_prob': float(maximum),
+            }
+            for start, end, mean, maximum in zip(starts[run_starts], ends[run_ends - 1], means, maxima)
+        ]
+
+    #Прогоняет тексты через нейронную сеть пакетами, выдаёт (номер текста, документ, вероятности).
+    #При выравнивании не до max_len тексты группируются по длине внутри пула из нескольких пакетов.
+    #Документы длиннее max_tokens токенов не прогоняются и выдаются с вероятностями None
+    def _predict_batches(self, texts, batch_size, padding=None, max_tokens=None):
+        if not self.model or not self.nlp:
+            raise RuntimeError("Processor not properly initialized")
+        padding = padding or self.padding
+        docs = self.nlp.pipe(texts, batch_size=batch_size)
+        pool_size = batch_size if padding == 'fixed' else batch_size * 8
+        for pool_start in range(0, len(texts), pool_size):
+            with metrics.timer('extract.tokenize'):
+                pool_docs = list(islice(docs, pool_size))
+            order = list(range(len(pool_docs)))
+            if padding != 'fixed':
+                order.sort(key=lambda i: len(pool_docs[i]))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                if max_tokens is not None:
+                    for i in batch:
+                        if len(pool_docs[i]) > max_tokens:
+                            yield pool_start + i, pool_docs[i], None
+                    batch = [i for i in batch if len(pool_docs[i]) <= max_tokens]
+                    if not batch:
+                        continue
+                batch_docs = [pool_docs[i] for i in batch]
+                test_seq = self.prepare_sequences(batch_docs, padding)
+                with metrics.timer('extract.predict'):
+                    predictions = self.model.predict(test_seq)
+                for i, doc, probabilities in zip(batch, batch_docs, predictions):
+                    yield pool_start + i, doc, probabilities
+
+    #Находит ингредиенты сразу в нескольких текстах, один вызов нейронной сети на пакет.
+    #Результаты возвращаются в порядке входных текстов
+    def extract_spans_batch(self, texts, batch_size=32, threshold=0.4, padding=None):
+        texts = list(texts)
+        results = [None] * len(texts)
+        for i, doc, probabilities in self._predict_batches(texts, batch_size, padding):
+            results[i] = self._decode(texts[i], *self._doc_arrays(doc, probabilities), threshold)
+        return results
+
+    #Находит ингредиенты в тексте, возвращает их с позициями и вероятностями
+    def extract_spans(self, text, threshold=0.4, padding=None):
+        return self.extract_spans_batch([text], batch_size=1, threshold=threshold, padding=padding)[0]
+
     #Основной метод выделения ингредиентов при помощи нейронной сети
     def extract_ingredients(self, text, threshold=0.4):
+        return ingredient_names(self.extract_spans(text, threshold=threshold))
+
+    #Выделяет ингредиенты сразу из нескольких текстов, результаты совпадают с extract_ingredients
+    def extract_ingredients_batch(self, texts, batch_size=32, threshold=0.4):
+        return [ingredient_names(spans) for spans in self.extract_spans_batch(texts, batch_size, threshold)]
+
+    #Делит текст на блоки по строкам, слишком длинные строки режутся по пробелам
+    def _iter_blocks(self, text, max_block=10000):
+        for match in re.finditer(r'[^\n]*\n*', text):
+            start, block = match.start(), match.group()
+            while len(block) > max_block:
+                cut = block.rfind(' ', 0, max_block) + 1 or max_block
+                yield block[:cut], start
+                start, block = start + cut, block[cut:]
+            if block:
+                yield block, start
+
+    #Токенизирует текст поблочно, не создавая Doc для всего текста сразу
+    def _iter_tokens(self, text):
+        for doc, offset in self.nlp.pipe(self._iter_blocks(text), as_tuples=True):
+            for token in doc:
+                yield token.idx + offset, token.text, self._filter(token)
+
+    #Прогоняет перекрывающиеся окна токенов через нейронную сеть и выдаёт готовые части текста
+    #в виде массивов для _decode. Вероятности усредняются по всем окнам, в которые токен попал.
+    #progress(позиция, длина текста) вызывается после каждого окна
+    def _iter_window_chunks(self, text, window, overlap, progress=None):
+        stride = window - overlap
+        tokens = self._iter_tokens(text)
+        buffer = []
+        sums = np.zeros(0)
+        counts = np.zeros(0)
+        pending = next(tokens, None)
+        while pending is not None:
+            with metrics.timer('extract.tokenize'):
+                buffer.append(pending)
+                buffer.extend(islice(tokens, window - len(buffer)))
+                pending = next(tokens, None)
+            sums = np.concatenate([sums, np.zeros(len(buffer) - len(sums))])
+            counts = np.concatenate([counts, np.zeros(len(buffer) - len(counts))])
+            seq = pad_sequences(
+                [self.vocab.lookup([t[1] for t in buffer])],
+                maxlen=window,
+                value=self.vocab.pad_id
+            )
+            with metrics.timer('extract.predict'):
+                sums += self.model.predict(seq)[0, :len(buffer), 0]
+            counts += 1
+            done = len(buffer) if pending is None else stride
+            starts = np.array([t[0] for t in buffer[:done]], dtype=np.int64)
+            ends = starts + np.array([len(t[1]) for t in buffer[:done]], dtype=np.int64)
+            mask = np.array([t[2] for t in buffer[:done]], dtype=bool)
+            yield starts, ends, mask, (sums[:done] / counts[:done]).astype(np.float32)
+            if progress:
+                progress(len(text) if pending is None else pending[0], len(text))
+            del buffer[:done]
+            sums, counts = sums[done:], counts[done:]
+
+    #Находит ингредиенты в тексте любой длины перекрывающимися окнами по window токенов.
+    #В памяти одновременно находится не больше одного окна токенов; ингредиент, который
+    #продолжается за границей готовой части, переносится в следующую часть
+    def extract_spans_windowed(self, text, window=400, overlap=100, threshold=0.4, progress=None):
         if not self.model or not self.nlp:
             raise RuntimeError("Processor not properly initialized")
-        doc = self.nlp(text)
-        test_tokenized = [doc]
-        test_seq = self.prepare_sequences(test_tokenized)
-        predictions = self.model.predict(test_seq)
-        ingredients = []
-        current_ingredient = []
-        for token, prob in zip(doc, predictions[0]):
-            prob_value = float(prob)
-            is_ingredient = prob_value > threshold
-            filter_passed = self._filter(token)
-            if is_ingredient and filter_passed:
-                current_ingredient.append(token)
+        if not 0 <= overlap < window:
+            raise ValueError("Overlap must be non-negative and smaller than the window")
+        spans = []
+        carry = None
+        for chunk in self._iter_window_chunks(text, window, overlap, progress):
+            if carry is not None:
+                chunk = tuple(np.concatenate([previous, current]) for previous, current in zip(carry, chunk))
+                carry = None
+            active = (chunk[3] > threshold) & chunk[2]
+            if active.size and active[-1]:
+                inactive = np.flatnonzero(~active)
+                cut = inactive[-1] + 1 if inactive.size else 0
+                carry = tuple(array[cut:] for array in chunk)
+                chunk = tuple(array[:cut] for array in chunk)
+            spans.extend(self._decode(text, *chunk, threshold))
+        if carry is not None:
+            spans.extend(self._decode(text, *carry, threshold))
+        return spans
+
+    #Выделяет ингредиенты из текста любой длины, см. extract_spans_windowed
+    def extract_ingredients_windowed(self, text, window=400, overlap=100, threshold=0.4, progress=None):
+        return ingredient_names(self.extract_spans_windowed(text, window, overlap, threshold, progress))
+
+    #То же, что extract_spans_windowed для каждого текста. Текст не длиннее окна - это одно окно,
+    #то есть обычный проход с маскированным выравниванием, поэтому такие тексты идут пакетами;
+    #более длинные обрабатываются окнами по одному
+    def extract_spans_windowed_batch(self, texts, window=400, overlap=100, threshold=0.4, batch_size=32,
+                                     padding=None):
+        if not 0 <= overlap < window:
+            raise ValueError("Overlap must be non-negative and smaller than the window")
+        texts = list(texts)
+        results = [None] * len(texts)
+        for i, doc, probabilities in self._predict_batches(texts, batch_size, padding, max_tokens=window):
+            if probabilities is None:
+                results[i] = self.extract_spans_windowed(texts[i], window, overlap, threshold)
             else:
-                if current_ingredient:
-                    start = current_ingredient[0].idx
-                    end = current_ingredient[-1].idx + len(current_ingredient[-1].text)
-                    ingredient = text[start:end].strip()
-                    if ingredient not in ingredients:
-                        ingredients.append(ingredient)
-                    current_ingredient = []
-        if current_ingredient:
-            start = current_ingredient[0].idx
-            end = current_ingredient[-1].idx + len(current_ingredient[-1].text)
-            ingredient = text[start:end].strip()
-            if ingredient not in ingredients:
-                ingredients.append(ingredient)
-        return sorted(ingredients)
+                results[i] = self._decode(texts[i], *self._doc_arrays(doc, probabilities), threshold)
+        return results
+
+    #Версия результатов извлечения: меняется при изменении файла модели, словаря или режима токенизации.
+    #Считается без загрузки модели
+    def model_version(self):
+        from inference import KERAS_MODEL_PATH, resolve_model_path
+        digest = hashlib.sha256()
+        digest.update(self.pipeline.encode())
+        for path in sorted({KERAS_MODEL_PATH, resolve_model_path(self.backend), VOCAB_PATH, VOCAB_TABLE_PATH}):
+            digest.update(file_digest(path).encode())
+        return digest.hexdigest()
+
+    def close(self):
+        self.model = None
+        self.nlp = None
+
+
+#Кэш результатов извлечения ингредиентов в таблице extraction_cache.
+#К нему обращается и рабочий поток извлечения, поэтому запросы идут через подключение текущего потока
+class ExtractionCache:
+    def __init__(self, database, max_entries=5000):
+        self.db = database
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.version = None
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                model_version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used)"
+        )
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        return self.db.connection()
+
+    #Формирует ключ из текста, версии модели и параметров извлечения
+    def make_key(self, version, kind, params, text):
+        digest = hashlib.sha256()
+        digest.update(f"{version}\0{kind}\0{json.dumps(params)}\0".encode())
+        digest.update(text.encode())
+        return digest.hexdigest()
+
+    #При смене версии модели удаляет все записи, посчитанные старой моделью
+    def _validate(self, version):
+        if version != self.version:
+            self.conn.execute("DELETE FROM extraction_cache WHERE model_version != ?", (version,))
+            self.conn.commit()
+            self.version = version
+
+    #Возвращает сохранённый результат или None
+    @timed('sql.cache_get')
+    def get(self, key, version):
+        with self.lock:
+            self._validate(version)
+            row = self.conn.execute("SELECT result FROM extraction_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                metrics.count('cache.miss')
+                return None
+            metrics.count('cache.hit')
+            self.conn.execute("UPDATE extraction_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return json.loads(row[0])
+
+    #То же для списка ключей одной транзакцией: результаты (или None) в порядке ключей.
+    #Используется пакетным извлечением, чтобы не фиксировать изменения после каждого текста
+    @timed('sql.cache_get_many')
+    def get_many(self, keys, version):
+        found = {}
+        with self.lock:
+            self._validate(version)
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), CACHE_QUERY_CHUNK):
+                chunk = unique[start:start + CACHE_QUERY_CHUNK]
+                found.update(self.conn.execute(
+                    f"SELECT key, result FROM extraction_cache WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                ))
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE extraction_cache SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self.conn.commit()
+        metrics.count('cache.hit', sum(key in found for key in keys))
+        metrics.count('cache.miss', sum(key not in found for key in keys))
+        return [json.loads(found[key]) if key in found else None for key in keys]
+
+    #Сохраняет результат, вытесняя давно не использованные записи сверх max_entries
+    @timed('sql.cache_put')
+    def put(self, key, version, result):
+        self.put_many([(key, result)], version)
+
+    #Сохраняет пары (ключ, результат) одной транзакцией с одним вытеснением в конце
+    @timed('sql.cache_put_many')
+    def put_many(self, items, version):
+        with self.lock:
+            self._validate(version)
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO extraction_cache (key, model_version, result, last_used) VALUES (?, ?, ?, ?)",
+                [(key, version, json.dumps(result, ensure_ascii=False), now) for key, result in items]
+            )
+            self.conn.execute('''
+                DELETE FROM extraction_cache WHERE key IN (
+                    SELECT key FROM extraction_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM extraction_cache")
+            self.conn.commit()
+
+
+#Работа с базой данных рецептов. Нейросетевая часть загружается отдельно,
+#чтобы база данных была доступна сразу после создания объекта.
+#backend='numpy-int8' включает квантованную модель (python inference.py quantize)
+class RecipeProcessor:
+    def __init__(self, backend='auto', db_path=DB_PATH):
+        self.db_path = db_path
+        self.extractor = IngredientExtractor(backend)
+        #Память процесса для канонических ингредиентов: написание -> id и id -> название
+        self.alias_ids = {}
+        self.canonical_titles = {}
+        self.resources_ready = threading.Event()
+        self.resources_error = None
+        self._loading_thread = None
+        self.init_db()
+        self.cache = ExtractionCache(self.db)
+
+    #Загружает нейросетевую часть в фоновом потоке. После загрузки вызывается on_ready(),
+    #при ошибке - on_failed(сообщение)
+    def load_resources_async(self, on_ready=None, on_failed=None):
+        if self._loading_thread is not None:
+            return
+        def load():
+            #Словари pymorphy3 загружаются здесь же, а не при первом сохранении рецепта в главном потоке,
+            #и независимо от модели: канонические ингредиенты нужны и без нейросетевой части
+            from morphology import load_analyzer
+            try:
+                load_analyzer()
+            except Exception as e:
+                print(f"Error loading morphology analyzer: {e}")
+            try:
+                self.extractor.init_resources()
+            except Exception as e:
+                self.resources_error = str(e)
+                self.resources_ready.set()
+                if on_failed:
+                    on_failed(self.resources_error)
+            else:
+                self.resources_ready.set()
+                if on_ready:
+                    on_ready()
+            try:
+                self.resolve_canonical_ingredients()
+            except Exception as e:
+                print(f"Error resolving canonical ingredients: {e}")
+        self._loading_thread = threading.Thread(target=load, name="resources-loader", daemon=True)
+        self._loading_thread.start()
+
+    #Ждёт окончания загрузки нейросетевой части, запуская её при необходимости
+    def wait_resources(self, timeout=None):
+        if self._loading_thread is None:
+            self.load_resources_async()
+        if not self.resources_ready.wait(timeout):
+            raise TimeoutError("Resources are still loading")
+        if self.resources_error:
+            raise RuntimeError(self.resources_error)
+        return self.extractor
+
+    #Проверяет, загружена ли нейросетевая часть без ошибок
+    def is_ready(self):
+        return self.resources_ready.is_set() and not self.resources_error
+
+    #Возвращает результат из кэша или вычисляет его функцией compute и сохраняет.
+    #При попадании в кэш модель не загружается
+    def _cached(self, kind, params, text, compute):
+        version = self.extractor.model_version()
+        key = self.cache.make_key(version, kind, params, text)
+        result = self.cache.get(key, version)
+        if result is None:
+            result = compute()
+            self.cache.put(key, version, result)
+        return result
+
+    #Методы выделения ингредиентов. Отвечают из кэша или дожидаются загрузки нейросетевой части.
+    #extract_spans* возвращают ингредиенты с позициями и вероятностями, extract_ingredients* - список названий.
+    #Все они проходят текст перекрывающимися окнами (extract_spans_windowed), поэтому конец длинного
+    #рецепта не обрезается, а кнопка извлечения и массовое извлечение дают для текста один результат.
+    #Короткие тексты приложения выравниваются до ближайшей степени двойки (APP_PADDING), а не до max_len:
+    #результат от этого не зависит, а абзац из десятка токенов не прогоняется через 2000 шагов LSTM
+    def extract_spans(self, text, threshold=0.4):
+        return self.extract_spans_windowed(text, threshold=threshold)
+
+    def extract_ingredients(self, text, threshold=0.4):
+        return ingredient_names(self.extract_spans(text, threshold=threshold))
+
+    def extract_ingredients_batch(self, texts, batch_size=32, threshold=0.4, window=400, overlap=100):
+        texts = list(texts)
+        version = self.extractor.model_version()
+        keys = [self.cache.make_key(version, 'windowed-spans', [window, overlap, threshold], text) for text in texts]
+        results = self.cache.get_many(keys, version)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            extracted = self.wait_resources().extract_spans_windowed_batch(
+                [texts[i] for i in missing], window=window, overlap=overlap, threshold=threshold,
+                batch_size=batch_size, padding=APP_PADDING
+            )
+            for i, result in zip(missing, extracted):
+                results[i] = result
+            self.cache.put_many([(keys[i], results[i]) for i in missing], version)
+        return [ingredient_names(spans) for spans in results]
+
+    #Без кэша: используется подсветкой ингредиентов, которая хранит результаты по абзацам сама
+    def extract_spans_batch(self, texts, batch_size=32, threshold=0.4, padding=APP_PADDING):
+        return self.wait_resources().extract_spans_windowed_batch(
+            texts, threshold=threshold, batch_size=batch_size, padding=padding
+        )
+
+    def extract_spans_windowed(self, text, window=400, overlap=100, threshold=0.4, progress=None):
+        return self._cached(
+            'windowed-spans', [window, overlap, threshold], text,
+            lambda: self.wait_resources().extract_spans_windowed(
+                text, window=window, overlap=overlap, threshold=threshold, progress=progress
+            )
+        )
+
+    def extract_ingredients_windowed(self, text, window=400, overlap=100, threshold=0.4, progress=None):
+        return ingredient_names(self.extract_spans_windowed(text, window, overlap, threshold, progress))
+
+    #Подключение и курсор текущего потока: методы можно вызывать и из фоновых потоков
+    @property
+    def conn(self):
+        return self.db.connection()
+
+    @property
+    def cursor(self):
+        return self.db.cursor()
 
     #Инициализирует подключение к базе данных
+    @timed('sql.init_db')
     def init_db(self):
-        self.conn = sqlite3.connect('recipes.db')
-        self.cursor = self.conn.cursor()
+        self.db = Database(self.db_path)
         self._create_tables()
         self._create_triggers()
+        #Индекс создаётся до переноса ингредиентов: _write_ingredients обновляет в нём строку рецепта
+        self._create_search_index()
+        self._migrate_ingredients()
+        migrate(self.conn)
 
     #Создаёт необходимые таблицы в базе данных
     def _create_tables(self):
@@ -123,7 +628,163 @@ class RecipeProcessor:
                 PRIMARY KEY (recipe_id, ingredient)
             )
         ''')
+        #Ингредиенты рецептов по одному в строке. normalized - название в нижнем регистре
+        #для точного поиска, canonical_id - канонический ингредиент для поиска по любой форме
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recipe_ingredients (
+                recipe_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                ingredient TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                canonical_id INTEGER,
+                FOREIGN KEY (recipe_id) REFERENCES recipes(id),
+                FOREIGN KEY (canonical_id) REFERENCES canonical_ingredients(id),
+                PRIMARY KEY (recipe_id, position)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_canonical ON recipe_ingredients (canonical_id, recipe_id)"
+        )
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_normalized ON recipe_ingredients (normalized, recipe_id)"
+        )
+        #Канонические ингредиенты: одна запись на набор лемм названия (см. morphology.ingredient_key)
+        #и все встреченные написания этого ингредиента
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS canonical_ingredients (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lemma_key TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ingredient_aliases (
+                alias TEXT PRIMARY KEY,
+                canonical_id INTEGER NOT NULL,
+                FOREIGN KEY (canonical_id) REFERENCES canonical_ingredients(id)
+            )
+        ''')
+        #Состояние массового импорта: сколько записей источника уже прочитано и сколько рецептов добавлено
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imports (
+                source TEXT PRIMARY KEY,
+                rows_done INTEGER NOT NULL,
+                recipes INTEGER NOT NULL,
+                updated TEXT NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    #Переносит ингредиенты из старого столбца recipes.ingredients (строки через '\n') в recipe_ingredients.
+    #Перенесённые рецепты получают NULL в старом столбце, поэтому повторный запуск ничего не делает,
+    #а прерванный перенос продолжается с оставшихся рецептов
+    @timed('sql.migrate_ingredients')
+    def _migrate_ingredients(self):
+        self.cursor.execute("SELECT id, ingredients FROM recipes WHERE ingredients IS NOT NULL")
+        rows = self.cursor.fetchall()
+        if not rows:
+            return
+        with self.conn:
+            for recipe_id, ingredients_text in rows:
+                self._write_ingredients(recipe_id, ingredients_text.split('\n') if ingredients_text else [])
+            self.conn.executemany(
+                "UPDATE recipes SET ingredients = NULL WHERE id = ?", [(recipe_id,) for recipe_id, _ in rows]
+            )
+    #Полнотекстовый индекс FTS5 по названию, категориям, ингредиентам и тексту рецепта.
+    #unicode61 без учёта регистра и диакритики; "ё" и "е" он различает, поэтому варианты написания
+    #добавляет в запрос fts_query. Префиксные индексы ускоряют поиск по началу слова.
+    #Название и текст синхронизируются триггерами на recipes, категории - на recipe_categories,
+    #ингредиенты обновляет _write_ingredients одной записью на рецепт. Строка индекса при вставке рецепта
+    #сразу включает уже записанные категории и ингредиенты - этим пользуется import_recipes
+    def _create_search_index(self):
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'recipes_fts'")
+        exists = self.cursor.fetchone() is not None
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+                name, categories, ingredients, text,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        ''')
+        def categories_of(recipe):
+            return f'''
+                (SELECT group_concat(c.name, ' ') FROM recipe_categories rc
+                 JOIN categories c ON c.id = rc.category_id WHERE rc.recipe_id = {recipe})
+            '''
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS recipes_fts_insert
+            AFTER INSERT ON recipes
+            BEGIN
+                INSERT INTO recipes_fts (rowid, name, categories, ingredients, text)
+                VALUES (
+                    NEW.id, NEW.name, coalesce({categories_of('NEW.id')}, ''),
+                    coalesce((SELECT group_concat(ingredient, ' ') FROM recipe_ingredients WHERE recipe_id = NEW.id), ''),
+                    NEW.text
+                );
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS recipes_fts_update
+            AFTER UPDATE OF name, text ON recipes
+            BEGIN
+                UPDATE recipes_fts SET name = NEW.name, text = NEW.text WHERE rowid = NEW.id;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS recipes_fts_delete
+            AFTER DELETE ON recipes
+            BEGIN
+                DELETE FROM recipes_fts WHERE rowid = OLD.id;
+            END
+        ''')
+        for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+            self.cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS recipes_fts_categories_{event.lower()}
+                AFTER {event} ON recipe_categories
+                BEGIN
+                    UPDATE recipes_fts SET categories = coalesce({categories_of(f'{row}.recipe_id')}, '')
+                    WHERE rowid = {row}.recipe_id;
+                END
+            ''')
+        self.cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS recipes_fts_category_rename
+            AFTER UPDATE OF name ON categories
+            BEGIN
+                UPDATE recipes_fts SET categories = coalesce({categories_of('recipes_fts.rowid')}, '')
+                WHERE rowid IN (SELECT recipe_id FROM recipe_categories WHERE category_id = NEW.id);
+            END
+        ''')
+        if not exists:
+            #Вес совпадения по столбцам: название, категории, ингредиенты, текст.
+            #Сортировку по rank FTS5 выполняет сам, и фрагменты строятся только для возвращаемых строк
+            self.cursor.execute(
+                "INSERT INTO recipes_fts (recipes_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 3.0, 1.0)')"
+            )
+            #Индекс создан для существующей базы - заполняем его один раз
+            self.cursor.execute(f'''
+                INSERT INTO recipes_fts (rowid, name, categories, ingredients, text)
+                SELECT r.id, r.name, coalesce({categories_of('r.id')}, ''),
+                       coalesce((SELECT group_concat(ingredient, ' ') FROM recipe_ingredients WHERE recipe_id = r.id), ''),
+                       r.text
+                FROM recipes r
+            ''')
         self.conn.commit()
+    #Заменяет список ингредиентов рецепта в recipe_ingredients. Изменения не фиксируются
+    def _write_ingredients(self, recipe_id, ingredients):
+        ingredients = [ingredient for ingredient in ingredients or [] if ingredient]
+        self.cursor.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
+        self.cursor.executemany(
+            "INSERT INTO recipe_ingredients (recipe_id, position, ingredient, normalized, canonical_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (recipe_id, position, ingredient, ingredient.strip().lower(),
+                 self._canonical_id(ingredient.strip()) if ingredient.strip() else None)
+                for position, ingredient in enumerate(ingredients)
+            ]
+        )
+        self.cursor.execute(
+            "UPDATE recipes_fts SET ingredients = ? WHERE rowid = ?", (' '.join(ingredients), recipe_id)
+        )
 
     #Создаёт триггеры в базе данных
     def _create_triggers(self):
@@ -138,80 +799,113 @@ class RecipeProcessor:
                 INSERT OR IGNORE INTO categories (name) VALUES ('Избранное');
             END
         ''')
-        self.cursor.execute('''
-            CREATE TRIGGER IF NOT EXISTS delete_empty_categories
-            AFTER DELETE ON recipe_categories
-            BEGIN
-                DELETE FROM categories
-                WHERE id IN (
-                    SELECT c.id FROM categories c
-                    LEFT JOIN recipe_categories rc ON c.id = rc.category_id
-                    WHERE rc.category_id IS NULL AND c.name NOT IN ('Все', 'Избранное')
-                );
-            END
-        ''')
+        #Пустые категории удаляют триггеры счётчика рецептов (migrations.add_category_recipe_count)
         self.conn.commit()
 
     # Методы, обеспечивающие CRUD-операции для рецептов и ингредиентов
     #Возвращает все рецепты отсортированные по имени
+    @timed('sql.get_recipes')
     def get_recipes(self):
         self.cursor.execute("SELECT id, name FROM recipes ORDER BY name")
         return self.cursor.fetchall()
+    #Возвращает все рецепты с их категориями одним запросом: список (id, название, [(id категории, название)]),
+    #отсортированный по названию
+    @timed('sql.get_recipes_with_categories')
+    def get_recipes_with_categories(self):
+        #Подключение для чтения: строки читаются потоком и группируются по рецепту без промежуточного fetchall
+        rows = self.db.reader().execute('''
+            SELECT r.id, r.name, c.id, c.name
+            FROM recipes r
+            LEFT JOIN recipe_categories rc ON r.id = rc.recipe_id
+            LEFT JOIN categories c ON rc.category_id = c.id
+            ORDER BY r.name, r.id, c.id
+        ''')
+        return [
+            (recipe_id, name, [(row[2], row[3]) for row in group if row[2] is not None])
+            for (recipe_id, name), group in groupby(rows, key=lambda row: (row[0], row[1]))
+        ]
     #Возвращает всю информацию о рецепте по его ID
+    @timed('sql.get_recipe')
     def get_recipe(self, recipe_id):
-        self.cursor.execute("SELECT name, text, ingredients FROM recipes WHERE id = ?", (recipe_id,))
+        self.cursor.execute("SELECT name, text FROM recipes WHERE id = ?", (recipe_id,))
         result = self.cursor.fetchone()
         if result:
             return {
                 'name': result[0],
                 'text': result[1],
-                'ingredients': result[2].split('\n') if result[2] else []
+                'ingredients': self.get_recipe_ingredients(recipe_id)
             }
         return None
     #Создаёт новый рецепт в базе данных
+    @timed('sql.create_recipe')
     def create_recipe(self, name, text, ingredients=None):
-        ingredients_text = '\n'.join(ingredients) if ingredients else ''
         self.cursor.execute(
-            "INSERT INTO recipes (name, text, ingredients) VALUES (?, ?, ?)",
-            (name, text, ingredients_text)
+            "INSERT INTO recipes (name, text) VALUES (?, ?)",
+            (name, text)
         )
+        recipe_id = self.cursor.lastrowid
+        self._write_ingredients(recipe_id, ingredients)
         self.conn.commit()
-        return self.cursor.lastrowid
+        return recipe_id
     #Обновляет рецепт
+    @timed('sql.update_recipe')
     def update_recipe(self, recipe_id, name, text, ingredients=None):
-        ingredients_text = '\n'.join(ingredients) if ingredients else ''
         self.cursor.execute(
-            "UPDATE recipes SET name = ?, text = ?, ingredients = ? WHERE id = ?",
-            (name, text, ingredients_text, recipe_id)
+            "UPDATE recipes SET name = ?, text = ? WHERE id = ?",
+            (name, text, recipe_id)
         )
+        self._write_ingredients(recipe_id, ingredients)
         self.conn.commit()
-    #Удаляет рецепт
+    #Удаляет рецепт. Сам рецепт удаляется первым: вместе с ним уходит строка полнотекстового индекса,
+    #и триггеры на удаление связей с категориями не перестраивают её ради каждой категории
+    @timed('sql.delete_recipe')
     def delete_recipe(self, recipe_id):
+        self.cursor.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
         self.cursor.execute("DELETE FROM recipe_categories WHERE recipe_id = ?", (recipe_id,))
         self.cursor.execute("DELETE FROM ingredient_quantities WHERE recipe_id = ?", (recipe_id,))
-        self.cursor.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
+        self.cursor.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
         self.conn.commit()
-    #Выполняет поиск рецепта по названию и категории
+    #Выполняет поиск рецепта по подстроке в названии и категории. Это фильтр строки поиска в интерфейсе,
+    #поэтому запрос идёт через подключение для чтения и не ждёт записей других потоков
+    @timed('sql.search_recipes')
     def search_recipes(self, search_term):
-        self.cursor.execute('''
+        return self.db.reader().execute('''
             SELECT DISTINCT r.id, r.name
             FROM recipes r
             LEFT JOIN recipe_categories rc ON r.id = rc.recipe_id
             LEFT JOIN categories c ON rc.category_id = c.id
             WHERE r.name LIKE ? OR c.name LIKE ?
             ORDER BY r.name
-        ''', (f"%{search_term}%", f"%{search_term}%"))
-        return self.cursor.fetchall()
+        ''', (f"%{search_term}%", f"%{search_term}%")).fetchall()
+    #Полнотекстовый поиск по названию, категориям, ингредиентам и тексту с ранжированием BM25.
+    #Каждое слово запроса ищется по началу без последних букв, поэтому "сметаной" находит "сметана".
+    #Возвращает (id, название, фрагмент с подсвеченными совпадениями), лучшие совпадения первыми
+    @timed('sql.full_text_search')
+    def full_text_search(self, query, limit=100, start_mark='<b>', end_mark='</b>'):
+        match = fts_query(query)
+        if not match:
+            return []
+        return self.db.reader().execute('''
+            SELECT rowid, name, snippet(recipes_fts, -1, ?, ?, '…', 12)
+            FROM recipes_fts
+            WHERE recipes_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (start_mark, end_mark, match, limit)).fetchall()
     #Получает список ингредиентов конкретного рецепта
+    @timed('sql.get_recipe_ingredients')
     def get_recipe_ingredients(self, recipe_id):
-        self.cursor.execute("SELECT ingredients FROM recipes WHERE id = ?", (recipe_id,))
-        result = self.cursor.fetchone()
-        return result[0].split('\n') if result and result[0] else []
+        self.cursor.execute(
+            "SELECT ingredient FROM recipe_ingredients WHERE recipe_id = ? ORDER BY position", (recipe_id,)
+        )
+        return [row[0] for row in self.cursor.fetchall()]
     #Получает информацию о количестве ингредиентов в рецепте
+    @timed('sql.get_ingredient_quantities')
     def get_ingredient_quantities(self, recipe_id):
         self.cursor.execute("SELECT ingredient, quantity FROM ingredient_quantities WHERE recipe_id = ?", (recipe_id,))
         return dict(self.cursor.fetchall())
     #Обновляет значения количества ингредиентов в рецепте
+    @timed('sql.update_ingredient_quantities')
     def update_ingredient_quantities(self, recipe_id, quantities):
         self.cursor.execute("DELETE FROM ingredient_quantities WHERE recipe_id = ?", (recipe_id,))
         for ingredient, quantity in quantities.items():
@@ -221,26 +915,327 @@ class RecipeProcessor:
             )
         self.conn.commit()
     #Обновляет список ингредиентов рецепта
+    @timed('sql.update_recipe_ingredients')
     def update_recipe_ingredients(self, recipe_id, ingredients):
-        ingredients_text = '\n'.join(ingredients) if ingredients else ''
-        self.cursor.execute(
-            "UPDATE recipes SET ingredients = ? WHERE id = ?",
-            (ingredients_text, recipe_id)
+        self._write_ingredients(recipe_id, ingredients)
+        self.conn.commit()
+    #Заново выделяет ингредиенты во всех рецептах (например, после обновления модели)
+    #и записывает результаты одной транзакцией. Как и кнопка извлечения в интерфейсе, сохраняет
+    #канонические названия без повторов в разных формах. Возвращает количество обработанных рецептов
+    @timed('sql.reextract_all_recipes')
+    def reextract_all_recipes(self, batch_size=32, threshold=0.4):
+        self.cursor.execute("SELECT id, text FROM recipes")
+        rows = self.cursor.fetchall()
+        if not rows:
+            return 0
+        extracted = self.extract_ingredients_batch(
+            [text for _, text in rows],
+            batch_size=batch_size,
+            threshold=threshold
         )
+        with self.conn:
+            for (recipe_id, _), ingredients in zip(rows, extracted):
+                self._write_ingredients(recipe_id, [name for _, name in self._canonical_ingredients(ingredients)])
+        return len(rows)
+
+
+    #Массовый импорт рецептов. records - поток словарей с ключами name и text и необязательными
+    #ingredients (список названий), quantities (ингредиент -> количество) и categories (список названий);
+    #None вместо записи означает пропущенную строку источника. Записи пишутся пакетами по chunk_size строк,
+    #каждый пакет - одна транзакция из нескольких executemany вместо фиксации после каждого рецепта.
+    #Если задан source, прогресс пакета сохраняется в imports в той же транзакции, и повторный импорт
+    #того же источника пропускает уже прочитанные строки. progress(прочитано строк, добавлено рецептов)
+    #вызывается после каждого пакета. Возвращает число рецептов, добавленных этим вызовом
+    @timed('sql.import_recipes')
+    def import_recipes(self, records, source=None, chunk_size=1000, progress=None):
+        from morphology import load_analyzer
+        load_analyzer()
+        rows_done, total = self.import_position(source)
+        imported = 0
+        chunk = []
+        pending = 0
+        for record in islice(records, rows_done, None):
+            pending += 1
+            if record is not None and record.get('name'):
+                chunk.append(record)
+            if pending == chunk_size:
+                rows_done += pending
+                imported += self._import_chunk(chunk, source, rows_done, total + imported + len(chunk))
+                chunk = []
+                pending = 0
+                if progress:
+                    progress(rows_done, total + imported)
+        if pending:
+            rows_done += pending
+            imported += self._import_chunk(chunk, source, rows_done, total + imported + len(chunk))
+            if progress:
+                progress(rows_done, total + imported)
+        return imported
+    #Сколько строк источника уже прочитано и сколько рецептов из него добавлено: (строки, рецепты)
+    def import_position(self, source):
+        if source is None:
+            return 0, 0
+        self.cursor.execute("SELECT rows_done, recipes FROM imports WHERE source = ?", (source,))
+        return self.cursor.fetchone() or (0, 0)
+    #Забывает прогресс импорта источника, чтобы следующий импорт начался с первой строки
+    def reset_import(self, source):
+        self.cursor.execute("DELETE FROM imports WHERE source = ?", (source,))
+        self.conn.commit()
+    #Записывает пакет импорта одной транзакцией. Идентификаторы рецептов назначаются заранее,
+    #поэтому категории и ингредиенты вставляются до самих рецептов: триггер recipes_fts_insert
+    #строит строку полнотекстового индекса сразу целиком, а add_default_category находит связь
+    #с "Все" уже существующей и ничего не меняет
+    @timed('sql.import_chunk')
+    def _import_chunk(self, records, source, rows_done, total):
         self.conn.commit()
+        #IMMEDIATE: блокировка записи берётся до выбора идентификаторов
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self.cursor.execute('''
+                SELECT max(
+                    coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'recipes'), 0),
+                    coalesce((SELECT max(id) FROM recipes), 0)
+                )
+            ''')
+            first_id = self.cursor.fetchone()[0] + 1
+            recipe_ids = range(first_id, first_id + len(records))
+
+            category_names = {'Все', 'Избранное'}
+            for record in records:
+                category_names.update(name for name in record.get('categories') or [] if name)
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO categories (name) VALUES (?)", [(name,) for name in category_names]
+            )
+            self.cursor.execute("SELECT name, id FROM categories")
+            category_ids = dict(self.cursor.fetchall())
+
+            links = []
+            ingredients = []
+            quantities = []
+            for recipe_id, record in zip(recipe_ids, records):
+                names = {'Все'}.union(name for name in record.get('categories') or [] if name)
+                links.extend((recipe_id, category_ids[name]) for name in names)
+                for position, ingredient in enumerate(i for i in record.get('ingredients') or [] if i):
+                    alias = ingredient.strip()
+                    ingredients.append((
+                        recipe_id, position, ingredient, alias.lower(), self._canonical_id(alias) if alias else None
+                    ))
+                quantities.extend(
+                    (recipe_id, ingredient, quantity)
+                    for ingredient, quantity in (record.get('quantities') or {}).items()
+                )
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO recipe_categories (recipe_id, category_id) VALUES (?, ?)", links
+            )
+            self.cursor.executemany(
+                "INSERT INTO recipe_ingredients (recipe_id, position, ingredient, normalized, canonical_id) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ingredients
+            )
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO ingredient_quantities (recipe_id, ingredient, quantity) VALUES (?, ?, ?)",
+                quantities
+            )
+            self.cursor.executemany(
+                "INSERT INTO recipes (id, name, text) VALUES (?, ?, ?)",
+                [(recipe_id, record['name'], record.get('text') or '') for recipe_id, record in zip(recipe_ids, records)]
+            )
+            if source is not None:
+                self.cursor.execute('''
+                    INSERT INTO imports (source, rows_done, recipes, updated) VALUES (?, ?, ?, datetime('now'))
+                    ON CONFLICT (source) DO UPDATE SET
+                        rows_done = excluded.rows_done, recipes = excluded.recipes, updated = excluded.updated
+                ''', (source, rows_done, total))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            #Записи о канонических ингредиентах, созданные в отменённой транзакции, исчезли вместе с ней
+            self.alias_ids.clear()
+            self.canonical_titles.clear()
+            raise
+        metrics.count('import.recipes', len(records))
+        return len(records)
+
+
+    # Методы для канонических ингредиентов
+    #Возвращает id канонического ингредиента для написания alias, при необходимости создавая запись.
+    #Пока анализатор морфологии загружается в фоне (load_resources_async), новое написание
+    #не лемматизируется, чтобы не блокировать вызывающий поток: возвращается None, и такие строки
+    #позже дополняет resolve_canonical_ingredients. Без фоновой загрузки анализатор загружается здесь же.
+    #Изменения не фиксируются: это делает вызывающий метод
+    def _canonical_id(self, alias):
+        canonical_id = self.alias_ids.get(alias)
+        if canonical_id is not None:
+            return canonical_id
+        #Уже встречавшееся написание не требует лемматизации
+        self.cursor.execute('''
+            SELECT c.id, c.name FROM ingredient_aliases a
+            JOIN canonical_ingredients c ON c.id = a.canonical_id
+            WHERE a.alias = ?
+        ''', (alias,))
+        row = self.cursor.fetchone()
+        if row is None:
+            from morphology import analyzer_ready, display_name, ingredient_key, load_analyzer, normal_form_score
+            if not analyzer_ready():
+                if self._loading_thread is not None and self._loading_thread.is_alive():
+                    return None
+                load_analyzer()
+            key = ingredient_key(alias)
+            name = display_name(alias)
+            self.cursor.execute("SELECT id, name FROM canonical_ingredients WHERE lemma_key = ?", (key,))
+            row = self.cursor.fetchone()
+            if row is None:
+                #Тот же ключ мог только что добавить другой поток
+                self.cursor.execute(
+                    "INSERT OR IGNORE INTO canonical_ingredients (lemma_key, name) VALUES (?, ?)", (key, name)
+                )
+                self.cursor.execute("SELECT id, name FROM canonical_ingredients WHERE lemma_key = ?", (key,))
+                row = self.cursor.fetchone()
+            elif normal_form_score(name) > normal_form_score(row[1]):
+                #Предпочитаем написание в начальной форме: по нему лучше ищется товар
+                self.cursor.execute("UPDATE canonical_ingredients SET name = ? WHERE id = ?", (name, row[0]))
+                row = (row[0], name)
+            self.cursor.execute(
+                "INSERT OR IGNORE INTO ingredient_aliases (alias, canonical_id) VALUES (?, ?)", (alias, row[0])
+            )
+        self.alias_ids[alias] = row[0]
+        self.canonical_titles[row[0]] = row[1]
+        return row[0]
+    #Ищет канонический ингредиент для названия, не создавая новых записей
+    def _find_canonical_id(self, name):
+        name = name.strip()
+        if name in self.alias_ids:
+            return self.alias_ids[name]
+        from morphology import ingredient_key
+        self.cursor.execute('''
+            SELECT canonical_id FROM ingredient_aliases WHERE alias = ?
+            UNION ALL
+            SELECT id FROM canonical_ingredients WHERE lemma_key = ?
+        ''', (name, ingredient_key(name)))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+    #Сопоставляет названиям ингредиентов канонические ингредиенты, создавая недостающие записи.
+    #Возвращает список (id, название) без повторов в порядке первого появления. Пока анализатор
+    #морфологии не загружен, новые написания возвращаются как есть с id None, повторы отсекаются по написанию
+    @timed('sql.canonical_ingredients')
+    def canonical_ingredients(self, names):
+        result = self._canonical_ingredients(names)
+        self.conn.commit()
+        return result
+    #То же без фиксации, для методов, которые пишут ингредиенты в своей транзакции
+    def _canonical_ingredients(self, names):
+        result = {}
+        for alias in names:
+            alias = alias.strip()
+            if alias:
+                canonical_id = self._canonical_id(alias)
+                if canonical_id is None:
+                    result.setdefault(alias.lower(), (None, alias))
+                else:
+                    result.setdefault(canonical_id, (canonical_id, self.canonical_titles[canonical_id]))
+        return list(result.values())
+    #Назначает канонические ингредиенты строкам recipe_ingredients, записанным до загрузки
+    #анализатора морфологии. Вызывается из потока загрузки ресурсов и перед поиском по ингредиентам.
+    #Возвращает число написаний
+    @timed('sql.resolve_canonical_ingredients')
+    def resolve_canonical_ingredients(self):
+        from morphology import load_analyzer
+        load_analyzer()
+        self.cursor.execute(
+            "SELECT DISTINCT ingredient, normalized FROM recipe_ingredients WHERE canonical_id IS NULL AND normalized != ''"
+        )
+        rows = self.cursor.fetchall()
+        with self.conn:
+            for ingredient, normalized in rows:
+                self.cursor.execute(
+                    "UPDATE recipe_ingredients SET canonical_id = ? "
+                    "WHERE normalized = ? AND ingredient = ? AND canonical_id IS NULL",
+                    (self._canonical_id(ingredient.strip()), normalized, ingredient)
+                )
+        return len(rows)
+    #Дополняет строки без канонического ингредиента, если они есть: иначе рецепты, сохранённые
+    #до загрузки анализатора или перенесённые из старой схемы, не находятся по ингредиенту
+    def _resolve_pending_canonical(self):
+        self.cursor.execute(
+            "SELECT 1 FROM recipe_ingredients WHERE canonical_id IS NULL AND normalized != '' LIMIT 1"
+        )
+        if self.cursor.fetchone() is not None:
+            self.resolve_canonical_ingredients()
+    #Названия ингредиентов без повторов в разных формах, например для заказа
+    def canonical_names(self, names):
+        return [name for _, name in self.canonical_ingredients(names)]
+    #Канонические ингредиенты рецепта в порядке списка ингредиентов
+    @timed('sql.get_recipe_canonical_ingredients')
+    def get_recipe_canonical_ingredients(self, recipe_id):
+        self.cursor.execute('''
+            SELECT c.id, c.name
+            FROM recipe_ingredients ri
+            JOIN canonical_ingredients c ON c.id = ri.canonical_id
+            WHERE ri.recipe_id = ?
+            GROUP BY c.id
+            ORDER BY MIN(ri.position)
+        ''', (recipe_id,))
+        return self.cursor.fetchall()
+    #Рецепты, в которых есть ингредиент name в любой форме ("сметана", "сметаной", "Сметану")
+    @timed('sql.find_recipes_by_ingredient')
+    def find_recipes_by_ingredient(self, name):
+        self._resolve_pending_canonical()
+        canonical_id = self._find_canonical_id(name)
+        if canonical_id is None:
+            return []
+        self.cursor.execute('''
+            SELECT r.id, r.name
+            FROM recipes r
+            WHERE r.id IN (SELECT recipe_id FROM recipe_ingredients WHERE canonical_id = ?)
+            ORDER BY r.name
+        ''', (canonical_id,))
+        return self.cursor.fetchall()
+    #Рецепты, в которых есть все перечисленные ингредиенты
+    @timed('sql.find_recipes_with_ingredients')
+    def find_recipes_with_ingredients(self, names):
+        self._resolve_pending_canonical()
+        canonical_ids = {self._find_canonical_id(name) for name in names}
+        if not canonical_ids or None in canonical_ids:
+            return []
+        placeholders = ', '.join('?' * len(canonical_ids))
+        self.cursor.execute(f'''
+            SELECT r.id, r.name
+            FROM recipes r
+            JOIN (
+                SELECT recipe_id FROM recipe_ingredients
+                WHERE canonical_id IN ({placeholders})
+                GROUP BY recipe_id
+                HAVING COUNT(DISTINCT canonical_id) = ?
+            ) matched ON matched.recipe_id = r.id
+            ORDER BY r.name
+        ''', (*canonical_ids, len(canonical_ids)))
+        return self.cursor.fetchall()
+    #Рецепты, где ингредиент записан именно так (без учёта регистра и пробелов по краям)
+    @timed('sql.find_recipes_by_ingredient_text')
+    def find_recipes_by_ingredient_text(self, text):
+        self.cursor.execute('''
+            SELECT r.id, r.name
+            FROM recipes r
+            WHERE r.id IN (SELECT recipe_id FROM recipe_ingredients WHERE normalized = ?)
+            ORDER BY r.name
+        ''', (text.strip().lower(),))
+        return self.cursor.fetchall()
 
 
     # Методы, обеспечивающие CRUD-операции для категорий
     #Возвращает список всех доступных категорий рецептов
+    @timed('sql.get_categories')
     def get_categories(self):
         self.cursor.execute("SELECT id, name FROM categories")
         return self.cursor.fetchall()
     #Добавляет новую категорию
+    @timed('sql.add_category')
     def add_category(self, name):
         self.cursor.execute("INSERT INTO categories (name) VALUES (?)", (name,))
         self.conn.commit()
         return self.cursor.lastrowid
     #Удаляет категорию
+    @timed('sql.delete_category')
     def delete_category(self, category_id):
         self.cursor.execute("SELECT name FROM categories WHERE id = ?", (category_id,))
         category_name = self.cursor.fetchone()[0]
@@ -251,6 +1246,7 @@ class RecipeProcessor:
         self.conn.commit()
         return True
     #Создаёт связь между рецептом и категорией
+    @timed('sql.add_recipe_to_category')
     def add_recipe_to_category(self, recipe_id, category_id):
         self.cursor.execute(
             "INSERT OR IGNORE INTO recipe_categories (recipe_id, category_id) VALUES (?, ?)",
@@ -258,10 +1254,12 @@ class RecipeProcessor:
         )
         self.conn.commit()
     #Возвращает название категории по ее ID
+    @timed('sql.get_category_by_id')
     def get_category_by_id(self, category_id):
         self.cursor.execute("SELECT id, name FROM categories WHERE id = ?", (category_id,))
         return self.cursor.fetchone()
     #Удаляет связь между рецептом и категорией
+    @timed('sql.remove_recipe_from_category')
     def remove_recipe_from_category(self, recipe_id, category_id):
         category = self.get_category_by_id(category_id)
         if not category:
@@ -281,6 +1279,7 @@ class RecipeProcessor:
             print(f"Error removing recipe from category: {e}")
             return False
     #Возвращает список категорий рецепта
+    @timed('sql.get_recipe_categories')
     def get_recipe_categories(self, recipe_id):
         self.cursor.execute('''
             SELECT c.id, c.name
@@ -291,7 +1290,6 @@ class RecipeProcessor:
         return self.cursor.fetchall()
 
     def close(self):
-        if hasattr(self, 'conn'):
-            self.conn.close()
-        if hasattr(self, 'nlp'):
-            self.nlp = None
+        if hasattr(self, 'db'):
+            self.db.close()
+        self.extractor.close()
@@ -0,0 +1,93 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from dataset import SOURCE_PATH, parse_composition
+from helpers import DB_PATH, RecipeProcessor
+
+
+#Разбирает строку CSV в запись для RecipeProcessor.import_recipes. Понимает выгрузку Kaggle
+#(name, Инструкции, composition) и простой формат: name, text, ingredients и categories через ';'.
+#Для строк без названия или текста возвращается None
+def parse_csv_row(row):
+    name = (row.get('name') or '').strip()
+    text = row.get('Инструкции') or row.get('text')
+    if not name or not text:
+        return None
+    record = {'name': name, 'text': text}
+    if row.get('composition'):
+        composition = parse_composition(row['composition']) or []
+        record['ingredients'] = [ingredient for ingredient, _ in composition]
+        record['quantities'] = {ingredient: quantity for ingredient, quantity in composition if quantity}
+    elif row.get('ingredients'):
+        record['ingredients'] = [item.strip() for item in row['ingredients'].split(';') if item.strip()]
+    if row.get('categories'):
+        record['categories'] = [item.strip() for item in row['categories'].split(';') if item.strip()]
+    return record
+
+
+#Читает CSV построчно. Разделитель определяется по заголовку: выгрузка Kaggle разделена табуляцией
+def read_csv(path):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        delimiter = '\t' if '\t' in f.readline() else ','
+        f.seek(0)
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield parse_csv_row(row)
+
+
+#Читает JSONL: по объекту {name, text, ingredients, quantities, categories} в строке.
+#Пустые и повреждённые строки возвращаются как None, чтобы нумерация строк не сбивалась
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line) if line.strip() else None
+            except json.JSONDecodeError:
+                record = None
+            yield record if isinstance(record, dict) else None
+
+
+def read_source(path):
+    if path.endswith('.jsonl'):
+        return read_jsonl(path)
+    return read_csv(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт рецептов из CSV или JSONL в базу данных")
+    parser.add_argument('source', nargs='?', default=SOURCE_PATH, help="файл .csv/.tsv (в том числе выгрузка Kaggle) или .jsonl")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--chunk-size', type=int, default=1000, help="строк источника в одной транзакции")
+    parser.add_argument('--restart', action='store_true', help="начать импорт заново, забыв сохранённый прогресс")
+    args = parser.parse_args()
+
+    processor = RecipeProcessor(db_path=args.db)
+    source = os.path.abspath(args.source)
+    try:
+        if args.restart:
+            processor.reset_import(source)
+        skipped, before = processor.import_position(source)
+        if skipped:
+            print(f"Продолжение импорта: {skipped} строк уже прочитано, {before} рецептов добавлено")
+        start = time.perf_counter()
+
+        def report(rows, recipes):
+            elapsed = time.perf_counter() - start
+            print(
+                f"Строк {rows}, рецептов {recipes}: "
+                f"{(rows - skipped) / elapsed:.0f} строк/с, {(recipes - before) / elapsed:.0f} рецептов/с"
+            )
+
+        imported = processor.import_recipes(
+            read_source(args.source), source=source, chunk_size=args.chunk_size, progress=report
+        )
+        print(f"Готово: добавлено {imported} рецептов за {time.perf_counter() - start:.1f} с")
+    finally:
+        processor.close()
+
+
+if __name__ == "__main__":
+    main()
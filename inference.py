@@ -0,0 +1,311 @@
+import argparse
+import os
+import pickle
+import sys
+import numpy as np
+
+KERAS_MODEL_PATH = 'recognize_model.keras'
+EXPORTED_MODEL_PATH = 'recognize_model.npz'
+QUANTIZED_MODEL_PATH = 'recognize_model.int8.npz'
+EXPORT_FORMAT_VERSION = 1
+EVALUATION_DATA_PATH = 'data123.pkl'
+
+
+class AccuracyRegression(Exception):
+    pass
+
+
+#Бэкенд на TensorFlow/Keras: исходная модель recognize_model.keras
+class KerasBackend:
+    def __init__(self, path=KERAS_MODEL_PATH):
+        # noinspection PyUnresolvedReferences
+        from tensorflow.keras.models import load_model
+        self.path = path
+        self.model = load_model(path)
+
+    #Возвращает вероятности ингредиентов формы (пакет, длина, 1)
+    def predict(self, sequences):
+        return self.model.predict(sequences, batch_size=len(sequences), verbose=0)
+
+
+#Бэкенд без TensorFlow: та же сеть Embedding -> BiLSTM x2 -> Dense, посчитанная на NumPy
+#по весам, выгруженным из Keras функцией export_model. Понимает и квантованные веса
+#из quantize_model: матрицы хранятся в int8 и восстанавливаются только на время вызова
+class NumpyBackend:
+    def __init__(self, path=EXPORTED_MODEL_PATH):
+        self.path = path
+        with np.load(path) as data:
+            if int(data['format_version']) != EXPORT_FORMAT_VERSION:
+                raise ValueError(f"Unsupported exported model version in {path}")
+            def load(name):
+                if f'{name}_q' in data:
+                    return data[f'{name}_q'], data[f'{name}_scale']
+                return data[name]
+            self.embedding = load('embedding')
+            self.lstm_layers = []
+            for n in range(int(data['lstm_count'])):
+                self.lstm_layers.append(tuple(
+                    tuple(load(f'lstm{n}_{direction}_{name}') for name in ('kernel', 'recurrent_kernel', 'bias'))
+                    for direction in ('forward', 'backward')
+                ))
+            self.dense_kernel = data['dense_kernel']
+            self.dense_bias = data['dense_bias']
+        self.vocab_size = len(self.embedding[0] if isinstance(self.embedding, tuple) else self.embedding)
+
+    #Возвращает строки матрицы эмбеддингов для индексов, восстанавливая только нужные строки
+    def _embed(self, sequences):
+        if isinstance(self.embedding, tuple):
+            quantized, scale = self.embedding
+            return quantized[sequences].astype(np.float32) * scale[sequences][..., None]
+        return self.embedding[sequences]
+
+    #Один проход LSTM по маскированной последовательности. На маскированных шагах состояние
+    #не меняется, а выход равен нулю, как в Keras при mask_zero=True
+    @staticmethod
+    def _lstm(x, mask, kernel, recurrent_kernel, bias, reverse):
+        batch, steps, _ = x.shape
+        units = recurrent_kernel.shape[0]
+        inputs = x @ kernel + bias
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        outputs = np.zeros((batch, steps, units), dtype=np.float32)
+        for t in (range(steps - 1, -1, -1) if reverse else range(steps)):
+            z = inputs[:, t] + h @ recurrent_kernel
+            i = _sigmoid(z[:, :units])
+            f = _sigmoid(z[:, units:2 * units])
+            g = np.tanh(z[:, 2 * units:3 * units])
+            o = _sigmoid(z[:, 3 * units:])
+            c_new = f * c + i * g
+            h_new = o * np.tanh(c_new)
+            m = mask[:, t, None]
+            c = np.where(m, c_new, c)
+            h = np.where(m, h_new, h)
+            outputs[:, t] = np.where(m, h_new, 0.0)
+        return outputs
+
+    #Возвращает вероятности ингредиентов формы (пакет, длина, 1).
+    #Хвост, состоящий только из <PAD>, не прогоняется через LSTM
+    def predict(self, sequences):
+        sequences = np.asarray(sequences)
+        mask = sequences != 0
+        steps = int(mask.any(axis=0).nonzero()[0].max()) + 1 if mask.any() else 1
+        x = self._embed(sequences[:, :steps])
+        for forward, backward in self.lstm_layers:
+            x = np.concatenate([
+                self._lstm(x, mask[:, :steps], *map(_dequantize, forward), reverse=False),
+                self._lstm(x, mask[:, :steps], *map(_dequantize, backward), reverse=True),
+            ], axis=-1)
+        probabilities = np.zeros(sequences.shape + (1,), dtype=np.float32)
+        probabilities[:, :steps] = _sigmoid(x @ self.dense_kernel + self.dense_bias)
+        probabilities[:, steps:] = _sigmoid(self.dense_bias)
+        return probabilities
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+#Восстанавливает float32-матрицу из пары (int8, масштаб по столбцам)
+def _dequantize(weights):
+    if isinstance(weights, tuple):
+        quantized, scale = weights
+        return quantized.astype(np.float32) * scale
+    return weights
+
+
+#Симметричное квантование в int8 с отдельным масштабом по оси axis
+def _quantize(weights, axis):
+    scale = np.abs(weights).max(axis=axis, keepdims=True) / 127.0
+    scale[scale == 0] = 1.0
+    quantized = np.clip(np.round(weights / scale), -127, 127).astype(np.int8)
+    return quantized, scale.astype(np.float32)
+
+
+#Создаёт бэкенд по имени: 'keras', 'numpy', 'numpy-int8' (квантованная модель)
+#или 'auto' (numpy, если модель уже выгружена)
+def load_backend(name='auto', path=None):
+    if name == 'auto':
+        try:
+            return NumpyBackend(path or EXPORTED_MODEL_PATH)
+        except FileNotFoundError:
+            return KerasBackend(KERAS_MODEL_PATH)
+    if name == 'keras':
+        return KerasBackend(path or KERAS_MODEL_PATH)
+    if name == 'numpy':
+        return NumpyBackend(path or EXPORTED_MODEL_PATH)
+    if name == 'numpy-int8':
+        return NumpyBackend(path or QUANTIZED_MODEL_PATH)
+    raise ValueError(f"Unknown inference backend: {name}")
+
+
+#Возвращает путь к файлу модели, который будет загружен бэкендом name
+def resolve_model_path(name='auto', path=None):
+    if path:
+        return path
+    if name == 'keras' or (name == 'auto' and not os.path.exists(EXPORTED_MODEL_PATH)):
+        return KERAS_MODEL_PATH
+    if name == 'numpy-int8':
+        return QUANTIZED_MODEL_PATH
+    return EXPORTED_MODEL_PATH
+
+
+#Выгружает веса Keras-модели в переносимый файл .npz для NumpyBackend
+def export_model(keras_path=KERAS_MODEL_PATH, output_path=EXPORTED_MODEL_PATH):
+    # noinspection PyUnresolvedReferences
+    from tensorflow.keras import layers
+    # noinspection PyUnresolvedReferences
+    from tensorflow.keras.models import load_model
+    model = load_model(keras_path)
+    weights = {'format_version': np.array(EXPORT_FORMAT_VERSION)}
+    lstm_count = 0
+    for layer in model.layers:
+        if isinstance(layer, layers.Embedding):
+            weights['embedding'] = layer.get_weights()[0].astype(np.float32)
+        elif isinstance(layer, layers.Bidirectional):
+            for direction, lstm in (('forward', layer.forward_layer), ('backward', layer.backward_layer)):
+                if lstm.activation.__name__ != 'tanh' or lstm.recurrent_activation.__name__ != 'sigmoid':
+                    raise ValueError(f"Unsupported LSTM activations in layer {layer.name}")
+                kernel, recurrent_kernel, bias = lstm.get_weights()
+                weights[f'lstm{lstm_count}_{direction}_kernel'] = kernel.astype(np.float32)
+                weights[f'lstm{lstm_count}_{direction}_recurrent_kernel'] = recurrent_kernel.astype(np.float32)
+                weights[f'lstm{lstm_count}_{direction}_bias'] = bias.astype(np.float32)
+            lstm_count += 1
+        elif isinstance(layer, layers.Dense):
+            kernel, bias = layer.get_weights()
+            weights['dense_kernel'] = kernel.astype(np.float32)
+            weights['dense_bias'] = bias.astype(np.float32)
+        elif not isinstance(layer, (layers.SpatialDropout1D, layers.Dropout)):
+            raise ValueError(f"Unsupported layer for export: {layer.name}")
+    weights['lstm_count'] = np.array(lstm_count)
+    np.savez(output_path, **weights)
+    return output_path
+
+
+#Квантует эмбеддинги и матрицы LSTM выгруженной модели в int8: эмбеддинги с масштабом по строкам,
+#матрицы LSTM - по выходным столбцам. Смещения и выходной слой остаются float32
+def quantize_model(input_path=EXPORTED_MODEL_PATH, output_path=QUANTIZED_MODEL_PATH):
+    weights = {}
+    with np.load(input_path) as data:
+        for name in data.files:
+            if name == 'embedding':
+                weights['embedding_q'], scale = _quantize(data[name], axis=1)
+                weights['embedding_scale'] = scale[:, 0]
+            elif name.startswith('lstm') and name.endswith('kernel'):
+                weights[f'{name}_q'], weights[f'{name}_scale'] = _quantize(data[name], axis=0)
+            else:
+                weights[name] = data[name]
+    np.savez(output_path, **weights)
+    return output_path
+
+
+#Сравнивает вероятности двух бэкендов на случайных последовательностях разной длины.
+#Возвращает максимальное расхождение на непустых позициях
+def check_parity(reference, candidate, vocab_size, samples=32, max_len=400, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_len + 1, size=samples)
+    sequences = np.zeros((samples, max_len), dtype=np.int32)
+    for i, length in enumerate(lengths):
+        sequences[i, :length] = rng.integers(1, vocab_size, size=length)
+    mask = sequences != 0
+    difference = np.abs(reference.predict(sequences)[..., 0] - candidate.predict(sequences)[..., 0])
+    return float(difference[mask].max())
+
+
+#Загружает отложенную выборку X_val, y_val, сохранённую блокнотом обучения
+def load_evaluation_data(path=EVALUATION_DATA_PATH):
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    return np.asarray(data['X_val']), np.asarray(data['y_val'])
+
+
+#Метрики на уровне токенов, как в evaluate_ner_model из блокнота: все позиции выборки
+#разворачиваются в один вектор, положительный класс - ингредиент
+def evaluate_ner_model(backend, X_test, y_test, threshold=0.6, batch_size=64):
+    y_pred = np.concatenate([
+        backend.predict(X_test[i:i + batch_size]) > threshold for i in range(0, len(X_test), batch_size)
+    ]).reshape(-1)
+    y_true = np.asarray(y_test).reshape(-1) > 0
+    true_positive = int(np.count_nonzero(y_pred & y_true))
+    precision = true_positive / max(int(np.count_nonzero(y_pred)), 1)
+    recall = true_positive / max(int(np.count_nonzero(y_true)), 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'accuracy': float((y_pred == y_true).mean()),
+    }
+
+
+#Сравнивает кандидата с эталонной моделью на отложенной выборке.
+#Бросает AccuracyRegression, если F1 упал больше чем на max_f1_drop
+def check_accuracy(reference, candidate, X_test, y_test, max_f1_drop=0.01, threshold=0.6):
+    reference_metrics = evaluate_ner_model(reference, X_test, y_test, threshold)
+    candidate_metrics = evaluate_ner_model(candidate, X_test, y_test, threshold)
+    drop = reference_metrics['f1'] - candidate_metrics['f1']
+    if drop > max_f1_drop:
+        raise AccuracyRegression(
+            f"F1 dropped by {drop:.4f} ({reference_metrics['f1']:.4f} -> {candidate_metrics['f1']:.4f}), "
+            f"allowed {max_f1_drop:.4f}"
+        )
+    return reference_metrics, candidate_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт модели и проверка бэкендов инференса")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="выгрузить веса Keras-модели в .npz")
+    export_parser.add_argument('--model', default=KERAS_MODEL_PATH)
+    export_parser.add_argument('--output', default=EXPORTED_MODEL_PATH)
+    parity_parser = subparsers.add_parser('parity', help="сравнить numpy-бэкенд с Keras")
+    parity_parser.add_argument('--model', default=KERAS_MODEL_PATH)
+    parity_parser.add_argument('--exported', default=EXPORTED_MODEL_PATH)
+    parity_parser.add_argument('--tolerance', type=float, default=1e-4)
+    quantize_parser = subparsers.add_parser('quantize', help="квантовать модель в int8 с проверкой F1")
+    quantize_parser.add_argument('--model', default=KERAS_MODEL_PATH)
+    quantize_parser.add_argument('--exported', default=EXPORTED_MODEL_PATH)
+    quantize_parser.add_argument('--output', default=QUANTIZED_MODEL_PATH)
+    quantize_parser.add_argument('--data', default=EVALUATION_DATA_PATH)
+    quantize_parser.add_argument('--max-f1-drop', type=float, default=0.01)
+    quantize_parser.add_argument('--threshold', type=float, default=0.6)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        print(f"Модель выгружена в {export_model(args.model, args.output)}")
+    elif args.command == 'parity':
+        candidate = NumpyBackend(args.exported)
+        difference = check_parity(KerasBackend(args.model), candidate, candidate.vocab_size)
+        print(f"Максимальное расхождение вероятностей: {difference:.2e}")
+        if difference > args.tolerance:
+            print(f"Расхождение превышает допуск {args.tolerance:.0e}")
+            sys.exit(1)
+    elif args.command == 'quantize':
+        #Модель сначала пишется во временный файл и заменяет рабочую только после проверки
+        candidate_path = quantize_model(args.exported, args.output + '.tmp.npz')
+        try:
+            X_val, y_val = load_evaluation_data(args.data)
+            reference_metrics, candidate_metrics = check_accuracy(
+                KerasBackend(args.model), NumpyBackend(candidate_path), X_val, y_val,
+                args.max_f1_drop, args.threshold,
+            )
+        except AccuracyRegression as e:
+            os.remove(candidate_path)
+            print(f"Квантованная модель отклонена: {e}")
+            sys.exit(1)
+        except Exception:
+            os.remove(candidate_path)
+            raise
+        os.replace(candidate_path, args.output)
+        for name, metrics in (('keras', reference_metrics), ('int8', candidate_metrics)):
+            print(
+                f"{name:>5}: precision {metrics['precision']:.4f}, recall {metrics['recall']:.4f}, "
+                f"F1 {metrics['f1']:.4f}"
+            )
+        print(
+            f"Модель записана в {args.output}: "
+            f"{os.path.getsize(args.output) / 2 ** 20:.1f} МБ вместо {os.path.getsize(args.exported) / 2 ** 20:.1f} МБ"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+#RECIPE_METRICS=1 включает сбор замеров и вывод сводки при завершении программы,
+#RECIPE_METRICS=путь.json - дополнительно сохраняет замеры в файл
+METRICS_ENV = 'RECIPE_METRICS'
+HISTOGRAM_BUCKETS = 40
+
+_disabled = nullcontext()
+
+
+#Гистограмма длительностей: корзина i содержит замеры до 2**i микросекунд
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (HISTOGRAM_BUCKETS + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS)] += 1
+
+    #Оценка перцентиля сверху: граница корзины, в которую он попадает
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max * 1000,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'p99_ms': self.quantile(0.99) * 1000,
+            'histogram_us': {f'<={2 ** i}': count for i, count in enumerate(self.buckets) if count},
+        }
+
+
+#Счётчики и гистограммы времени для горячих участков. Пока сбор выключен,
+#timer() возвращает общий пустой контекстный менеджер, а count() сразу выходит
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.add(seconds)
+
+    #Контекстный менеджер, замеряющий время блока под именем name
+    def timer(self, name):
+        if not self.enabled:
+            return _disabled
+        return _Timer(self, name)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timings': {name: histogram.to_dict() for name, histogram in sorted(self.timings.items())},
+            }
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+    #Печатает сводку: самые затратные участки первыми
+    def log_summary(self, stream=None):
+        stream = stream or sys.stderr
+        snapshot = self.snapshot()
+        timings = sorted(snapshot['timings'].items(), key=lambda item: -item[1]['total_ms'])
+        for name, stats in timings:
+            print(
+                f"{name:>36}: {stats['count']:7d} раз, всего {stats['total_ms']:10.1f} мс, "
+                f"p50 {stats['p50_ms']:8.2f} мс, p99 {stats['p99_ms']:8.2f} мс, макс {stats['max_ms']:8.2f} мс",
+                file=stream
+            )
+        for name, value in sorted(snapshot['counters'].items()):
+            print(f"{name:>36}: {value}", file=stream)
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+metrics = Metrics()
+
+
+#Декоратор: замеряет время каждого вызова функции под именем name
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+#Включает сбор по переменной окружения RECIPE_METRICS и регистрирует вывод при завершении
+def configure_from_env():
+    value = os.environ.get(METRICS_ENV)
+    if not value or value == '0':
+        return
+    metrics.enable()
+
+    def report():
+        metrics.log_summary()
+        if value.endswith('.json'):
+            metrics.export_json(value)
+    atexit.register(report)
+
+
+configure_from_env()
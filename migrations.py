@@ -0,0 +1,144 @@
+import argparse
+
+#Изменения схемы поверх базовой, которую создаёт RecipeProcessor._create_tables и соседние методы.
+#Номер миграции - её позиция в списке, начиная с 1: номер последней применённой хранится
+#в PRAGMA user_version. Новые миграции добавляются только в конец списка.
+#Каждая миграция идемпотентна, чтобы её можно было безопасно повторить на базе, где часть изменений уже есть
+
+
+#Индексы для горячих запросов: рецепты категории и удаление категории ищут связи по category_id,
+#список рецептов сортируется по названию. Индекс по categories(name) не нужен:
+#ограничение UNIQUE уже создаёт его (sqlite_autoindex_categories_1)
+def add_listing_indexes(conn):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_recipe_categories_category ON recipe_categories (category_id, recipe_id)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recipes_name ON recipes (name)")
+
+
+#Статистика по индексам для планировщика запросов. Дальше её обновляет PRAGMA optimize при закрытии базы
+def analyze(conn):
+    conn.execute("ANALYZE")
+
+
+#Число рецептов в каждой категории, которое поддерживают триггеры на recipe_categories.
+#Прежний триггер delete_empty_categories при удалении каждой связи перебирал все категории
+#со всеми связями; теперь удаляется только категория, из которой ушёл последний рецепт.
+#Пустые категории, созданные пользователем, больше не исчезают при удалении чужих связей
+def add_category_recipe_count(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(categories)")]
+    if 'recipe_count' not in columns:
+        conn.execute("ALTER TABLE categories ADD COLUMN recipe_count INTEGER NOT NULL DEFAULT 0")
+    conn.execute('''
+        UPDATE categories SET recipe_count = (
+            SELECT COUNT(*) FROM recipe_categories WHERE category_id = categories.id
+        )
+    ''')
+    conn.execute("DROP TRIGGER IF EXISTS delete_empty_categories")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_count_insert
+        AFTER INSERT ON recipe_categories
+        BEGIN
+            UPDATE categories SET recipe_count = recipe_count + 1 WHERE id = NEW.category_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS category_count_delete
+        AFTER DELETE ON recipe_categories
+        BEGIN
+            UPDATE categories SET recipe_count = recipe_count - 1 WHERE id = OLD.category_id;
+            DELETE FROM categories
+            WHERE id = OLD.category_id AND recipe_count <= 0 AND name NOT IN ('Все', 'Избранное');
+        END
+    ''')
+
+
+MIGRATIONS = [
+    add_listing_indexes,
+    analyze,
+    add_category_recipe_count,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+#Применяет миграции, которых ещё нет в базе, каждую в своей транзакции вместе с новым номером версии.
+#Версия перечитывается под блокировкой записи: если два процесса открыли базу одновременно,
+#второй не повторит миграции первого. Возвращает номера применённых миграций
+def migrate(conn, migrations=MIGRATIONS):
+    applied = []
+    conn.commit()
+    while schema_version(conn) < len(migrations):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < len(migrations):
+                migrations[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                applied.append(version + 1)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return applied
+
+
+#Горячие запросы и индексы, которыми они должны пользоваться: (название, SQL, параметры, индекс)
+HOT_QUERIES = [
+    ('список рецептов', "SELECT id, name FROM recipes ORDER BY name", (), 'idx_recipes_name'),
+    ('рецепты категории', "SELECT recipe_id FROM recipe_categories WHERE category_id = ?", (1,),
+     'idx_recipe_categories_category'),
+    ('удаление категории', "DELETE FROM recipe_categories WHERE category_id = ?", (1,),
+     'idx_recipe_categories_category'),
+    ('категория по названию', "SELECT id FROM categories WHERE name = ?", ('Все',), 'sqlite_autoindex_categories_1'),
+    ('категории рецепта', '''
+        SELECT c.id, c.name FROM categories c
+        JOIN recipe_categories rc ON c.id = rc.category_id
+        WHERE rc.recipe_id = ?
+    ''', (1,), 'sqlite_autoindex_recipe_categories_1'),
+    ('ингредиенты рецепта', "SELECT ingredient FROM recipe_ingredients WHERE recipe_id = ? ORDER BY position", (1,),
+     'PRIMARY KEY'),
+    ('рецепты с ингредиентом', "SELECT recipe_id FROM recipe_ingredients WHERE canonical_id = ?", (1,),
+     'idx_recipe_ingredients_canonical'),
+]
+
+
+#Проверяет по EXPLAIN QUERY PLAN, что горячие запросы используют свои индексы и не сортируют
+#результат во временном B-дереве. Возвращает список (название, план) для запросов, не прошедших проверку
+def check_query_plans(conn, queries=HOT_QUERIES):
+    failures = []
+    for name, sql, params, index in queries:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        uses_index = any(index in step for step in plan)
+        if not uses_index or any('USE TEMP B-TREE' in step for step in plan):
+            failures.append((name, plan))
+    return failures
+
+
+def main():
+    from helpers import DB_PATH, RecipeProcessor
+    parser = argparse.ArgumentParser(description="Версия схемы базы рецептов и проверка планов запросов")
+    parser.add_argument('command', choices=['status', 'check'])
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    #RecipeProcessor применяет недостающие миграции при открытии базы
+    processor = RecipeProcessor(db_path=args.db)
+    try:
+        if args.command == 'status':
+            print(f"Версия схемы: {schema_version(processor.conn)} из {len(MIGRATIONS)}")
+        elif args.command == 'check':
+            failures = check_query_plans(processor.conn)
+            for name, plan in failures:
+                print(f"{name}: индекс не используется\n    " + '\n    '.join(plan))
+            print(f"Проверено запросов: {len(HOT_QUERIES)}, с ошибками: {len(failures)}")
+            if failures:
+                raise SystemExit(1)
+    finally:
+        processor.close()
+
+
+if __name__ == "__main__":
+    main()
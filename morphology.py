@@ -0,0 +1,78 @@
+import re
+import threading
+from functools import lru_cache
+
+LEMMA_CACHE_SIZE = 200000
+
+_analyzer = None
+_analyzer_missing = False
+_analyzer_lock = threading.Lock()
+
+
+#Анализатор pymorphy3 создаётся при первом обращении: загрузка словарей занимает заметное время
+def get_analyzer():
+    global _analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            from pymorphy3 import MorphAnalyzer
+            _analyzer = MorphAnalyzer()
+    return _analyzer
+
+
+#Загружает анализатор, если pymorphy3 установлен. Возвращает False, если пакета нет:
+#тогда ключи ингредиентов строятся по словам в нижнем регистре без лемматизации
+def load_analyzer():
+    global _analyzer_missing
+    if _analyzer_missing:
+        return False
+    try:
+        get_analyzer()
+    except ImportError:
+        _analyzer_missing = True
+        return False
+    return True
+
+
+#Анализатор уже загружен или точно недоступен - ключи можно считать, не дожидаясь загрузки словарей
+def analyzer_ready():
+    return _analyzer is not None or _analyzer_missing
+
+
+#Нормальная форма слова в нижнем регистре. Результаты запоминаются: словарь рецептов
+#невелик, и одни и те же слова повторяются в тексте очень часто
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(word):
+    return get_analyzer().parse(word)[0].normal_form.lower()
+
+
+WORD_PATTERN = re.compile(r'[^\W\d_]+(?:-[^\W\d_]+)*')
+
+
+#Лемма слова в нижнем регистре для ключей и названий ингредиентов; без pymorphy3 - само слово
+def _lemma(word):
+    return lemmatize(word) if load_analyzer() else word
+
+
+#Ключ канонического ингредиента: отсортированные леммы слов названия.
+#"Муку", "муки" и "мука" получают ключ "мука", "мука пшеничная" и "пшеничной муки" - "мука пшеничный"
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def ingredient_key(name):
+    lemmas = {_lemma(word) for word in WORD_PATTERN.findall(name.lower())}
+    return ' '.join(sorted(lemmas)) or name.strip().lower()
+
+
+#Доля слов названия, стоящих в начальной форме. Из написаний одного ингредиента
+#лучше всего для поиска подходит то, где эта доля больше: "мука пшеничная", а не "пшеничной муки"
+def normal_form_score(name):
+    words = WORD_PATTERN.findall(name.lower())
+    return sum(_lemma(word) == word for word in words) / len(words) if words else 0.0
+
+
+#Название для показа и заказа. Одно слово приводится к начальной форме ("муки" -> "мука"),
+#в названиях из нескольких слов окончания прилагательных зависят от рода, поэтому они остаются как есть
+def display_name(name):
+    name = name.strip()
+    words = WORD_PATTERN.findall(name.lower())
+    if len(words) == 1 and WORD_PATTERN.fullmatch(name) and load_analyzer():
+        return lemmatize(words[0])
+    return name
@@ -0,0 +1,112 @@
+import argparse
+import os
+import pickle
+import zlib
+import numpy as np
+from dataset import MAX_LEN, OUTPUT_DIR, iter_examples
+from helpers import VOCAB_PATH, VOCAB_TABLE_PATH
+from inference import KERAS_MODEL_PATH
+from vocab import Vocabulary, verify, write_vocabulary
+
+BUCKET_BOUNDARIES = [32, 64, 128, 256]
+TOKENS_PER_BATCH = 8192
+
+
+#Модель из блокнота: Embedding -> SpatialDropout -> BiLSTM x2 -> Dense.
+#Длина входа не фиксируется, поэтому пакеты могут иметь разную длину
+def build_model(vocab_size, embedding_dim=50, units=128):
+    # noinspection PyUnresolvedReferences
+    import tensorflow as tf
+    # noinspection PyUnresolvedReferences
+    from tensorflow.keras import layers
+    model = tf.keras.Sequential([
+        layers.Input(shape=(None,), dtype='int32'),
+        layers.Embedding(input_dim=vocab_size, mask_zero=True, output_dim=embedding_dim),
+        layers.SpatialDropout1D(0.2),
+        layers.Bidirectional(layers.LSTM(units=units, return_sequences=True)),
+        layers.SpatialDropout1D(0.2),
+        layers.Bidirectional(layers.LSTM(units=units, return_sequences=True)),
+        layers.Dense(1, activation='sigmoid'),
+    ])
+    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+
+#Пример попадает в проверочную часть по хэшу его индексов: разбиение не зависит
+#от размера шардов и одинаково между запусками
+def _is_validation(tokens, val_fraction):
+    return zlib.crc32(tokens.tobytes()) % 1000 < val_fraction * 1000
+
+
+#Поток примеров из шардов для tf.data. Примеры длиннее max_len обрезаются, как при обучении в блокноте
+def make_dataset(output_dir=OUTPUT_DIR, validation=False, val_fraction=0.2, max_len=MAX_LEN,
+                 boundaries=BUCKET_BOUNDARIES, tokens_per_batch=TOKENS_PER_BATCH, shuffle_buffer=10000):
+    # noinspection PyUnresolvedReferences
+    import tensorflow as tf
+
+    def examples():
+        for tokens, labels in iter_examples(output_dir):
+            if not len(tokens) or _is_validation(tokens, val_fraction) != validation:
+                continue
+            yield tokens[:max_len], labels[:max_len].astype(np.float32)[:, None]
+
+    dataset = tf.data.Dataset.from_generator(examples, output_signature=(
+        tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        tf.TensorSpec(shape=(None, 1), dtype=tf.float32),
+    ))
+    if not validation:
+        dataset = dataset.shuffle(shuffle_buffer)
+    #Размер пакета в корзине подбирается так, чтобы число токенов в пакете было примерно одинаковым
+    boundaries = [b for b in boundaries if b < max_len]
+    batch_sizes = [max(1, tokens_per_batch // length) for length in boundaries + [max_len]]
+    dataset = dataset.bucket_by_sequence_length(
+        element_length_func=lambda tokens, labels: tf.shape(tokens)[0],
+        bucket_boundaries=boundaries,
+        bucket_batch_sizes=batch_sizes,
+        padded_shapes=([None], [None, 1]),
+    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+#Обучает модель на шардах dataset.py и сохраняет её вместе со словарём,
+#с которым она обучалась: индексы токенов в модели и словаре должны совпадать.
+#Словарь пишется и в pickle, и в vocab.bin: приложение читает vocab.bin первым,
+#и оставшийся от прежней модели файл сопоставил бы токенам старые индексы
+def train(output_dir=OUTPUT_DIR, model_path=KERAS_MODEL_PATH, vocab_path=VOCAB_PATH, epochs=5,
+          max_len=MAX_LEN, tokens_per_batch=TOKENS_PER_BATCH, vocab_table_path=VOCAB_TABLE_PATH):
+    with open(os.path.join(output_dir, 'vocab.pkl'), 'rb') as f:
+        vocab = pickle.load(f)['vocab']
+    model = build_model(len(vocab))
+    model.summary()
+    model.fit(
+        make_dataset(output_dir, max_len=max_len, tokens_per_batch=tokens_per_batch),
+        validation_data=make_dataset(output_dir, validation=True, max_len=max_len, tokens_per_batch=tokens_per_batch),
+        epochs=epochs,
+    )
+    model.save(model_path)
+    with open(vocab_path, 'wb') as f:
+        pickle.dump({'vocab': vocab}, f)
+    write_vocabulary(vocab, vocab_table_path, source=vocab_path)
+    mismatches = verify(vocab, Vocabulary.open(vocab_table_path))
+    if mismatches:
+        raise ValueError(f"{vocab_table_path} does not match the training vocabulary: {mismatches[:5]}")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение модели выделения ингредиентов на шардах dataset.py")
+    parser.add_argument('--dataset', default=OUTPUT_DIR)
+    parser.add_argument('--model', default=KERAS_MODEL_PATH)
+    parser.add_argument('--vocab', default=VOCAB_PATH)
+    parser.add_argument('--vocab-table', default=VOCAB_TABLE_PATH)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--max-len', type=int, default=MAX_LEN)
+    parser.add_argument('--tokens-per-batch', type=int, default=TOKENS_PER_BATCH)
+    args = parser.parse_args()
+    train(args.dataset, args.model, args.vocab, args.epochs, args.max_len, args.tokens_per_batch, args.vocab_table)
+    print(f"Модель сохранена в {args.model}, словарь - в {args.vocab} и {args.vocab_table}. "
+          f"Обновите recognize_model.npz: python inference.py export")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import struct
+import sys
+import numpy as np
+
+PICKLE_PATH = 'minimal_data.pkl'
+VOCAB_PATH = 'vocab.bin'
+MAGIC = b'RMVOCAB2'
+#Сигнатура, ширина таблицы, число ключей, размер JSON длинных токенов, <UNK>, <PAD>
+#и sha256 pickle-файла, из которого построен словарь (нули, если словарь записан не из файла)
+HEADER = struct.Struct('<8sIIIii32s')
+MAX_KEY_WIDTH = 48
+
+
+#Словарь токен -> индекс в виде отсортированной таблицы строк фиксированной ширины.
+#Файл открывается через mmap: загрузка почти мгновенная, страницы общие для всех процессов.
+#Токены длиннее ширины таблицы (их единицы) хранятся отдельно в обычном словаре
+class Vocabulary:
+    def __init__(self, keys, ids, overflow, unk_id, pad_id, source_digest=None):
+        self.keys = keys
+        self.ids = ids
+        self.overflow = overflow
+        self.width = keys.dtype.itemsize
+        self.unk_id = unk_id
+        self.pad_id = pad_id
+        self.source_digest = source_digest
+        self.memo = {}
+
+    #Открывает файл словаря, записанный функцией write_vocabulary
+    @classmethod
+    def open(cls, path=VOCAB_PATH):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a vocabulary file of this version")
+            _, width, count, overflow_size, unk_id, pad_id, source_digest = HEADER.unpack(header)
+            f.seek(HEADER.size + count * (width + 4))
+            overflow = json.loads(f.read(overflow_size).decode('utf-8'))
+        keys = np.memmap(path, dtype=f'S{width}', mode='r', offset=HEADER.size, shape=(count,))
+        ids = np.memmap(path, dtype='<i4', mode='r', offset=HEADER.size + count * width, shape=(count,))
+        return cls(keys, ids, overflow, unk_id, pad_id, source_digest)
+
+    #Строит словарь в памяти из обычного dict (например, из minimal_data.pkl)
+    @classmethod
+    def from_dict(cls, vocab):
+        keys, ids, overflow = _split_entries(vocab)
+        return cls(keys, ids, overflow, vocab["<UNK>"], vocab["<PAD>"])
+
+    #Возвращает индексы для списка токенов, неизвестные токены получают <UNK>.
+    #Токены, которых ещё нет в памяти процесса, ищутся в таблице одним пакетом и запоминаются
+    def lookup(self, tokens):
+        memo = self.memo
+        missing = list({token for token in tokens if token not in memo})
+        if missing:
+            memo.update(zip(missing, self._search(missing).tolist()))
+        return np.array([memo[token] for token in tokens], dtype=np.int32)
+
+    #Двоичный поиск пакета уникальных токенов в таблице
+    def _search(self, tokens):
+        encoded = [token.encode('utf-8') for token in tokens]
+        keys = np.array(encoded, dtype=f'S{self.width}')
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[positions] == keys
+        result = np.where(found, self.ids[positions], self.unk_id).astype(np.int32)
+        for i, key in enumerate(encoded):
+            if not _fits(key, self.width):
+                result[i] = self.overflow.get(tokens[i], self.unk_id)
+        return result
+
+    def get(self, token, default=None):
+        if token not in self:
+            return default
+        return int(self.lookup([token])[0])
+
+    def __contains__(self, token):
+        key = token.encode('utf-8')
+        if not _fits(key, self.width):
+            return token in self.overflow
+        position = int(np.searchsorted(self.keys, np.array([key], dtype=f'S{self.width}'))[0])
+        return position < len(self.keys) and self.keys[position] == key
+
+    def __getitem__(self, token):
+        token_id = self.get(token)
+        if token_id is None:
+            raise KeyError(token)
+        return token_id
+
+    def __len__(self):
+        return len(self.keys) + len(self.overflow)
+
+
+#Ключ помещается в таблицу, если он не длиннее ширины и не содержит нулевых байтов
+def _fits(key, width):
+    return len(key) <= width and b'\0' not in key
+
+
+#Делит словарь на отсортированную таблицу фиксированной ширины и длинные токены
+def _split_entries(vocab):
+    encoded = [(token.encode('utf-8'), token_id) for token, token_id in vocab.items()]
+    lengths = sorted(len(key) for key, _ in encoded)
+    width = max(1, min(MAX_KEY_WIDTH, lengths[int(len(lengths) * 0.999)] if lengths else 1))
+    table = [(key, token_id) for key, token_id in encoded if _fits(key, width)]
+    overflow = {key.decode('utf-8'): token_id for key, token_id in encoded if not _fits(key, width)}
+    keys = np.array([key for key, _ in table], dtype=f'S{width}')
+    ids = np.array([token_id for _, token_id in table], dtype='<i4')
+    order = np.argsort(keys, kind='stable')
+    return keys[order], ids[order], overflow
+
+
+#sha256 содержимого файла
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+#Записывает словарь в файл формата Vocabulary. source - pickle-файл, из которого взят словарь:
+#его sha256 сохраняется в заголовке, чтобы load_vocabulary заметила, что pickle заменили
+def write_vocabulary(vocab, path=VOCAB_PATH, source=None):
+    keys, ids, overflow = _split_entries(vocab)
+    overflow_data = json.dumps(overflow, ensure_ascii=False).encode('utf-8')
+    source_digest = file_digest(source) if source else bytes(32)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, keys.dtype.itemsize, len(keys), len(overflow_data), vocab["<UNK>"], vocab["<PAD>"], source_digest
+        ))
+        f.write(keys.tobytes())
+        f.write(ids.tobytes())
+        f.write(overflow_data)
+    return path
+
+
+#Читает словарь из pickle-файла, сохранённого блокнотом обучения
+def load_pickled_vocab(path=PICKLE_PATH):
+    with open(path, 'rb') as f:
+        return pickle.load(f)['vocab']
+
+
+#Открывает vocab.bin, если он построен из текущего pickle-файла, иначе строит словарь из pickle.
+#Блокнот обучения перезаписывает minimal_data.pkl, и оставшийся от прежнего файла vocab.bin
+#сопоставил бы токенам старые индексы
+def load_vocabulary(table_path=VOCAB_PATH, pickle_path=PICKLE_PATH):
+    if os.path.exists(table_path):
+        try:
+            vocabulary = Vocabulary.open(table_path)
+        except ValueError as e:
+            print(f"{e}, loading {pickle_path} instead")
+        else:
+            if not os.path.exists(pickle_path) or vocabulary.source_digest == file_digest(pickle_path):
+                return vocabulary
+            print(f"{table_path} was built from another {pickle_path}, loading the pickle; "
+                  f"rebuild it with: python vocab.py convert")
+    return Vocabulary.from_dict(load_pickled_vocab(pickle_path))
+
+
+#Проверяет, что каждый токен исходного словаря получает тот же индекс. Возвращает список расхождений
+def verify(vocab, vocabulary):
+    tokens = list(vocab)
+    ids = vocabulary.lookup(tokens)
+    mismatches = [(token, vocab[token], int(token_id)) for token, token_id in zip(tokens, ids) if vocab[token] != token_id]
+    if len(vocabulary) != len(vocab):
+        mismatches.append(('<size>', len(vocab), len(vocabulary)))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компактный словарь токенов для выделения ингредиентов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (('convert', "преобразовать minimal_data.pkl"), ('verify', "сверить индексы с pickle")):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument('--input', default=PICKLE_PATH)
+        command_parser.add_argument('--output', default=VOCAB_PATH)
+    args = parser.parse_args()
+
+    vocab = load_pickled_vocab(args.input)
+    if args.command == 'convert':
+        write_vocabulary(vocab, args.output, source=args.input)
+        print(f"Записано {len(vocab)} токенов в {args.output}")
+    vocabulary = Vocabulary.open(args.output)
+    if vocabulary.source_digest != file_digest(args.input):
+        print(f"{args.output} построен не из {args.input}: выполните python vocab.py convert")
+        sys.exit(1)
+    mismatches = verify(vocab, vocabulary)
+    if mismatches:
+        print(f"Индексы не совпадают для {len(mismatches)} токенов, например: {mismatches[:5]}")
+        sys.exit(1)
+    print("Индексы совпадают для всех токенов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import queue
+import threading
+from PySide6.QtCore import QObject, Signal
+
+
+class ExtractionCancelled(Exception):
+    pass
+
+
+#Асинхронное выделение ингредиентов. Модель используется только рабочим потоком сервиса,
+#задания получают номер, результаты возвращаются через сигналы Qt в главный поток
+class ExtractionService(QObject):
+    progress = Signal(int, int)
+    finished = Signal(int, list)
+    spans_finished = Signal(int, list, list)
+    failed = Signal(int, str)
+    cancelled = Signal(int)
+
+    def __init__(self, processor, parent=None):
+        super().__init__(parent)
+        self.processor = processor
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.last_job_id = 0
+        #Задания выполняются по порядку номеров: все номера до finished_job_id включительно уже завершены
+        self.finished_job_id = 0
+        self.cancelled_jobs = set()
+        self.thread = threading.Thread(target=self._run, name="extraction-worker", daemon=True)
+        self.thread.start()
+
+    #Ставит текст в очередь на извлечение и возвращает номер задания.
+    #Результат приходит сигналом finished
+    def submit(self, text):
+        return self._submit('ingredients', text)
+
+    #Ставит в очередь поиск границ ингредиентов в нескольких фрагментах текста.
+    #Результат приходит сигналом spans_finished(номер, фрагменты, границы)
+    def submit_spans(self, texts):
+        return self._submit('spans', list(texts))
+
+    def _submit(self, kind, payload):
+        with self.lock:
+            self.last_job_id += 1
+            job_id = self.last_job_id
+        self.jobs.put((job_id, kind, payload))
+        return job_id
+
+    #Отменяет задание: ещё не начатое пропускается, выполняемое прерывается после текущего окна.
+    #Номера завершённых заданий не запоминаются: интерфейс отменяет задание при каждом изменении текста
+    def cancel(self, job_id):
+        with self.lock:
+            if job_id > self.finished_job_id:
+                self.cancelled_jobs.add(job_id)
+
+    #Останавливает рабочий поток после текущего задания
+    def shutdown(self):
+        with self.lock:
+            self.cancelled_jobs.update(range(self.finished_job_id + 1, self.last_job_id + 1))
+        self.jobs.put(None)
+
+    def _is_cancelled(self, job_id):
+        with self.lock:
+            return job_id in self.cancelled_jobs
+
+    #Основной цикл рабочего потока
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            job_id, kind, payload = job
+            def report(position, total):
+                if self._is_cancelled(job_id):
+                    raise ExtractionCancelled()
+                self.progress.emit(job_id, int(position * 100 / max(total, 1)))
+            try:
+                if self._is_cancelled(job_id):
+                    raise ExtractionCancelled()
+                if kind == 'spans':
+                    self.spans_finished.emit(
+                        job_id, payload, self.processor.extract_spans_batch(payload, padding='bucket')
+                    )
+                    continue
+                report(0, len(payload))
+                result = self.processor.extract_ingredients_windowed(payload, progress=report)
+                if self._is_cancelled(job_id):
+                    raise ExtractionCancelled()
+                self.finished.emit(job_id, result)
+            except ExtractionCancelled:
+                self.cancelled.emit(job_id)
+            except Exception as e:
+                self.failed.emit(job_id, str(e))
+            finally:
+                with self.lock:
+                    self.finished_job_id = job_id
+                    self.cancelled_jobs.discard(job_id)
+
+
+#Поиск рецептов по подстроке в названии и категориях (RecipeProcessor.search_recipes) в фоновом потоке
+#через подключение к базе только для чтения: поиск не ждёт записей главного потока и не мешает им.
+#Если пока выполнялся запрос
+#пришли новые, выполняется только последний - промежуточные результаты никому не нужны
+class SearchService(QObject):
+    finished = Signal(int, str, list)
+    failed = Signal(int, str)
+
+    def __init__(self, processor, parent=None):
+        super().__init__(parent)
+        self.processor = processor
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.last_job_id = 0
+        self.thread = threading.Thread(target=self._run, name="search-worker", daemon=True)
+        self.thread.start()
+
+    #Ставит запрос в очередь и возвращает его номер. Результат - сигнал finished(номер, запрос, id рецептов)
+    def submit(self, text):
+        with self.lock:
+            self.last_job_id += 1
+            job_id = self.last_job_id
+        self.jobs.put((job_id, text))
+        return job_id
+
+    def shutdown(self):
+        self.jobs.put(None)
+
+    def _run(self):
+        try:
+            while True:
+                job = self.jobs.get()
+                while job is not None and not self.jobs.empty():
+                    job = self.jobs.get_nowait()
+                if job is None:
+                    return
+                job_id, text = job
+                with self.lock:
+                    if job_id != self.last_job_id:
+                        continue
+                try:
+                    ids = [row[0] for row in self.processor.search_recipes(text)]
+                    self.finished.emit(job_id, text, ids)
+                except Exception as e:
+                    self.failed.emit(job_id, str(e))
+        finally:
+            self.processor.db.release()